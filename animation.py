@@ -1,38 +1,26 @@
 import pygame
+from bisect import bisect_left
+from itertools import accumulate
 
 
 class Animation:
-    def __init__(self, name, frames, durations, hitbox_size=None, offsets=None):
+    def __init__(self, name, frames, durations, hitbox_size=None, offsets=None, rate=None):
         self.name = name
-        self.frames = frames
-        self.durations = durations
-        self.frame_count = 0
-        self.sprite_num = 0
-        self.total_duration = sum(durations)
+        self.frames = tuple(frames)
+        self.durations = tuple(durations)
+        self.frame_ends = tuple(accumulate(durations))
+        self.total_duration = self.frame_ends[-1]
         self.hitbox_size = hitbox_size
-        self.offsets = offsets or [pygame.Vector2(0, 0) for _ in frames]
+        self.offsets = tuple(offsets or [pygame.Vector2(0, 0) for _ in frames])
+        # Duration units per unit of dt. Without a rate the animation advances one unit per update, as it always did
+        self.rate = rate
 
-    def next_frame(self):
-        self.frame_count += 1
-        if self.frame_count > sum(self.durations[:self.sprite_num + 1]):
-            if self.frame_count > self.total_duration:
-                self.reset()
-            else:
-                self.sprite_num += 1
-
-    def get_current_sprite(self):
-        return self.frames[self.sprite_num]
-
-    @property
-    def image_offset(self):
-        return self.offsets[self.sprite_num]
-
-    def reset(self):
-        self.frame_count = 0
-        self.sprite_num = 0
-
-    def __copy__(self):
-        return Animation(self.name,
-                         [s.copy() for s in self.frames],
-                         self.durations.copy(),
-                         self.offsets.copy())
+    def advance(self, time, sprite_num, dt):
+        time += dt * self.rate if self.rate else 1
+        if time > self.total_duration:
+            # Whole steps wrap to 0 as they always did, scaled ones carry the remainder over into the next loop
+            time = time % self.total_duration if self.rate else time % (self.total_duration + 1)
+            sprite_num = 0
+        if time > self.frame_ends[sprite_num] or (sprite_num and time <= self.frame_ends[sprite_num - 1]):
+            sprite_num = bisect_left(self.frame_ends, time)
+        return time, sprite_num
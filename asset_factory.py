@@ -1,52 +1,172 @@
+import mmap
 import os
-from pygame import image, transform, Vector2
+import struct
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pygame import image, transform, Rect, Surface, Vector2, SRCALPHA, BLEND_RGBA_MAX
 from animation import Animation
 
 _asset_root_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)), "bin")
-_sprites_to_load = [
-    'player_neutral_flight_1',
-    'player_neutral_flight_2',
-    'player_neutral_flight_3',
-    'player_neutral',
-    'assault_soldier_neutral',
-    'black',
-    'platform',
-    'yellow_bullet',
-    'green_proj_1',
-    'green_proj_2',
-    'worm_head_1',
-    'worm_head_2',
-    'worm_segment',
-    'blue_sky',
-    'chain_link_fence',
-    'foothills',
-    'mountains',
-]
+# Each group decodes as one batch and is packed into its own atlas, so the first use of a sprite only waits for the
+# sprites it is drawn alongside
+_sprite_groups = {
+    'player': ['player_neutral_flight_1', 'player_neutral_flight_2', 'player_neutral_flight_3', 'player_neutral',
+               'yellow_bullet'],
+    'soldiers': ['assault_soldier_neutral', 'green_proj_1', 'green_proj_2'],
+    'terrain': ['black', 'platform'],
+    'backgrounds': ['blue_sky', 'chain_link_fence', 'foothills', 'mountains'],
+}
+
+
+def _sprite_path(name, extension="png"):
+    return os.path.join(_asset_root_folder, "sprites", name + "." + extension)
+
+
+def _raw_cache_path(name):
+    return os.path.join(_asset_root_folder, "cache", name + ".rgba")
+
+
+def _read_raw_cache(name):
+    path = _raw_cache_path(name)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(_sprite_path(name)):
+        return None
+    with open(path, 'rb') as f:
+        pixels = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    width, height = struct.unpack_from('<II', pixels)
+    return image.frombuffer(memoryview(pixels)[8:], (width, height), 'RGBA')
+
+
+def _write_raw_cache(name, surface):
+    path = _raw_cache_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(struct.pack('<II', *surface.get_size()))
+        f.write(image.tobytes(surface, 'RGBA'))
+    os.replace(path + '.tmp', path)
+
+
+def _decode_sprite(name, raw_cache=False):
+    # Runs on the loader threads, so no display-dependent conversion happens here
+    if raw_cache:
+        cached = _read_raw_cache(name)
+        if cached is not None:
+            return cached
+    surface = image.load(_sprite_path(name))
+    if raw_cache:
+        _write_raw_cache(name, surface)
+    return surface
+
+
+def surface_bytes(surfaces):
+    # Subsurfaces share their parent's pixels, so each underlying buffer is only counted once
+    buffers = {id(parent): parent for parent in (surface.get_abs_parent() for surface in surfaces)}
+    return sum(buffer.get_width() * buffer.get_height() * buffer.get_bytesize() for buffer in buffers.values())
+
+
+def animation_frames(animations):
+    for animation in animations.values():
+        if isinstance(animation, dict):
+            yield from animation_frames(animation)
+        else:
+            yield from animation.frames
+
+
+class SpriteAtlas:
+    max_width = 2048
+
+    def __init__(self, images):
+        width = max([self.max_width, *(sprite.get_width() for sprite in images.values())])
+        placements = {}
+        x = y = shelf_height = used_width = 0
+        for name, sprite in sorted(images.items(), key=lambda item: item[1].get_height(), reverse=True):
+            if x + sprite.get_width() > width:
+                x, y, shelf_height = 0, y + shelf_height, 0
+            placements[name] = Rect((x, y), sprite.get_size())
+            x += sprite.get_width()
+            used_width = max(used_width, x)
+            shelf_height = max(shelf_height, sprite.get_height())
+
+        self.surface = Surface((max(used_width, 1), max(y + shelf_height, 1)), SRCALPHA).convert_alpha()
+        self.surface.fill((0, 0, 0, 0))
+        for name, rect in placements.items():
+            # Taking the max against the transparent atlas copies pixels exactly, where a normal blit would blend them
+            self.surface.blit(images[name], rect, special_flags=BLEND_RGBA_MAX)
+        self.sprites = {name: self.surface.subsurface(rect) for name, rect in placements.items()}
 
 
 class AssetFactory:
-    def __init__(self):
+    transform_cache_size = 256
+    loader_threads = 4
+
+    def __init__(self, preload=False, raw_cache=False):
         self._loaded_sprites = {}
-        self.load_sprites(_sprites_to_load)
+        self._pending = {}
+        self.atlases = []
+        self.raw_cache = raw_cache
+        # Started by the first preload, sprites loaded on demand are decoded on the calling thread
+        self._loader = None
+        if preload:
+            self.preload_groups(_sprite_groups)
+        # Keyed on (name, transform, *args), so every wall of the same size shares one scaled surface.
+        # transformed_sprite.cache_info() reports hits and misses
+        self.transformed_sprite = lru_cache(maxsize=self.transform_cache_size)(self._transform_sprite)
+        # Every transformed surface still alive, whether the cache or an animation holds it, for memory_report
+        self._transformed = weakref.WeakValueDictionary()
+
+    def preload(self, sprite_names):
+        # Decodes in the background and returns straight away. The batch is converted and packed into one atlas the
+        # first time any sprite in it is asked for, so levels preload the next level's sprites while the cutscene plays
+        names = [name for name in sprite_names if name not in self._loaded_sprites and name not in self._pending]
+        if not names:
+            return
+        if self._loader is None:
+            self._loader = ThreadPoolExecutor(max_workers=self.loader_threads)
+        batch = {name: self._loader.submit(_decode_sprite, name, self.raw_cache) for name in names}
+        for name in batch:
+            self._pending[name] = batch
 
-    def load_sprites(self, sprite_names):
-        for name in sprite_names:
-            self._loaded_sprites[name] = AssetFactory._load_sprite(name)
+    def preload_groups(self, groups):
+        for group in groups:
+            self.preload(_sprite_groups[group])
 
-    @staticmethod
-    def _load_sprite(sprite_file_name, extension="png"):
-        return image.load(
-            os.path.join(_asset_root_folder, "sprites", sprite_file_name + "." + extension)).convert_alpha()
+    def _finish_batch(self, batch):
+        images = {name: future.result().convert_alpha() for name, future in batch.items()}
+        for name in batch:
+            del self._pending[name]
+        atlas = SpriteAtlas(images)
+        self.atlases.append(atlas)
+        self._loaded_sprites.update(atlas.sprites)
 
     def get_sprite(self, name):
+        # Sprites are shared between every animation that uses them and must not be drawn on
         if name not in self._loaded_sprites:
-            self._load_sprite(name)
-        return self._loaded_sprites[name].copy()
+            if name in self._pending:
+                self._finish_batch(self._pending[name])
+            else:
+                self._loaded_sprites[name] = _decode_sprite(name, self.raw_cache).convert_alpha()
+        return self._loaded_sprites[name]
+
+    def _transform_sprite(self, name, transform_name, *args):
+        transformed = getattr(transform, transform_name)(self.get_sprite(name), *args)
+        self._transformed[(name, transform_name, *args)] = transformed
+        return transformed
+
+    def memory_report(self):
+        report = {name: sprite.get_width() * sprite.get_height() * sprite.get_bytesize()
+                  for name, sprite in self._loaded_sprites.items()}
+        atlas_bytes = sum(atlas.surface.get_width() * atlas.surface.get_height() * atlas.surface.get_bytesize()
+                          for atlas in self.atlases)
+        in_atlases = sum(report[name] for atlas in self.atlases for name in atlas.sprites)
+        report['(atlas padding)'] = atlas_bytes - in_atlases
+        for (name, transform_name, *args), surface in self._transformed.items():
+            report[f"{name} {transform_name} {', '.join(map(str, args))}"] = \
+                surface.get_width() * surface.get_height() * surface.get_bytesize()
+        return report
 
     def player_animations(self):
-        flight_sprites = [self.get_sprite("player_neutral_flight_1"),
-                          self.get_sprite("player_neutral_flight_2"),
-                          self.get_sprite("player_neutral_flight_3")]
+        flight_sprite_names = ["player_neutral_flight_1", "player_neutral_flight_2", "player_neutral_flight_3"]
+        flight_sprites = [self.get_sprite(name) for name in flight_sprite_names]
         durations = [18 for _ in range(len(flight_sprites))]
         animations = [Animation(name='neutral',
                                 frames=[self.get_sprite("player_neutral")],
@@ -59,12 +179,12 @@ class AssetFactory:
                                 hitbox_size=Vector2(18, 48),
                                 offsets=[(-25, -5) for _ in flight_sprites]),
                       Animation(name='fly_left',
-                                frames=[transform.rotate(s, 20) for s in flight_sprites],
+                                frames=[self.transformed_sprite(name, 'rotate', 20) for name in flight_sprite_names],
                                 durations=durations,
                                 hitbox_size=Vector2(25, 48),
                                 offsets=[Vector2(-29, -15) for _ in flight_sprites]),
                       Animation(name='fly_right',
-                                frames=[transform.rotate(s, -20) for s in flight_sprites],
+                                frames=[self.transformed_sprite(name, 'rotate', -20) for name in flight_sprite_names],
                                 durations=durations,
                                 hitbox_size=Vector2(25, 48),
                                 offsets=[Vector2(-28, -15) for _ in flight_sprites])]
@@ -77,7 +197,7 @@ class AssetFactory:
     def background(self):
         return {'neutral': Animation(
             name='neutral',
-            frames=[transform.scale(self.get_sprite('blue_sky'), (960, 720))],
+            frames=[self.transformed_sprite('blue_sky', 'scale', (960, 720))],
             durations=[123])}
 
     def chain_fence(self):
@@ -100,13 +220,13 @@ class AssetFactory:
 
     def wall_animation(self, width, height):
         return {'neutral': Animation('neutral',
-                                     [transform.scale(self.get_sprite("black"), (width, height))],
+                                     [self.transformed_sprite("black", 'scale', (width, height))],
                                      [1000],
                                      Vector2(width, height))}
 
     def platform_animation(self, width, height):
         return {'neutral': Animation('neutral',
-                                     [transform.scale(self.get_sprite("platform"), (width, height))],
+                                     [self.transformed_sprite("platform", 'scale', (width, height))],
                                      [1000],
                                      Vector2(width, height))}
 
@@ -118,7 +238,7 @@ class AssetFactory:
                                         hitbox_size=Vector2(24, 50),
                                         offsets=[Vector2(-12, -9)]),
                 'face_left': Animation(name='face_left',
-                                       frames=[transform.flip(neutral, True, False)],
+                                       frames=[self.transformed_sprite("assault_soldier_neutral", 'flip', True, False)],
                                        durations=[1234],
                                        hitbox_size=Vector2(24, 50),
                                        offsets=[Vector2(-27, -9)]),
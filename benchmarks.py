@@ -0,0 +1,605 @@
+import gc
+import itertools
+import os
+import random
+import sys
+import timeit
+
+import pygame
+
+from animation import Animation
+from collision import SpatialHash
+from enemy_classes import AssaultSoldier
+from game_objects import Background, ParallaxBackground, Player, Projectile, ProjectilePool
+from game_state import EntityList, GameState
+from hud import Hud
+from terrain import Terrain
+
+WORLD_WIDTH = 20000
+WORLD_HEIGHT = 2000
+
+
+def _animations(*names, size=(24, 50)):
+    return {name: Animation(name, [pygame.Surface(size)], [1000], pygame.Vector2(size)) for name in names}
+
+
+def _random_pos(rng):
+    return pygame.Vector2(rng.uniform(0, WORLD_WIDTH), rng.uniform(0, WORLD_HEIGHT))
+
+
+class _AllTargets:
+    def __init__(self, objects):
+        self.objects = list(objects)
+
+    def query(self, rect):
+        return self.objects
+
+
+def collision_world(enemy_count, projectile_count, terrain_count=50, seed=0):
+    rng = random.Random(seed)
+    soldier_animations = _animations('face_right', 'face_left')
+    soldier_animations['projectile'] = _animations('neutral', size=(6, 6))
+    bullet_animations = _animations('neutral', size=(3, 3))
+    terrain = [Terrain(animations=_animations('neutral', size=(rng.randint(20, 400), rng.randint(8, 100))),
+                       initial_pos=_random_pos(rng))
+               for _ in range(terrain_count)]
+    enemies = [AssaultSoldier(initial_pos=_random_pos(rng), animations=soldier_animations)
+               for _ in range(enemy_count)]
+    for enemy in enemies:
+        enemy.health = float('inf')
+    projectiles = [Projectile(animations=bullet_animations,
+                              initial_pos=_random_pos(rng),
+                              initial_vel=pygame.Vector2(rng.uniform(-40, 40), rng.uniform(-40, 40)),
+                              damage=100)
+                   for _ in range(projectile_count)]
+    return terrain, enemies, projectiles
+
+
+def bench_collision(counts=(100, 500, 1000, 2000, 4000), repeats=5):
+    print(f"{'entities':>10} {'brute force ms':>16} {'spatial hash ms':>16} {'speedup':>8}")
+    for count in counts:
+        terrain, enemies, projectiles = collision_world(enemy_count=count, projectile_count=count)
+
+        def brute_force_tick():
+            targets = _AllTargets([*terrain, *enemies])
+            for proj in projectiles:
+                proj.update(0, targets)
+
+        def spatial_hash_tick():
+            targets = SpatialHash([*terrain, *enemies])
+            for proj in projectiles:
+                proj.update(0, targets)
+
+        brute = min(timeit.repeat(brute_force_tick, number=1, repeat=repeats)) * 1000
+        hashed = min(timeit.repeat(spatial_hash_tick, number=1, repeat=repeats)) * 1000
+        print(f"{count:>10} {brute:>16.2f} {hashed:>16.2f} {brute / hashed:>7.1f}x")
+
+
+def _end_position_update(proj, dt, broadphase):
+    # How Projectile.update tested for hits before it swept the path: only where it ended up
+    proj.x += proj.x_vel * dt
+    proj.y += proj.y_vel * dt
+    for target in broadphase.query(proj.hitbox):
+        if proj.hitbox.colliderect(target.hitbox):
+            proj.to_remove = True
+            return
+
+
+def bench_projectile_sweep(count=5000, dts=(0.25, 1, 4), ticks=20, seed=0):
+    platform_rng = random.Random(seed)
+    platforms = [Terrain(animations=_animations('neutral', size=(300, 8)),
+                         initial_pos=_random_pos(platform_rng),
+                         platform=True)
+                 for _ in range(500)]
+    platform_index = SpatialHash(platforms)
+    bullet_animations = _animations('neutral', size=(3, 3))
+
+    def fire(dt, update):
+        rng = random.Random(seed)
+        projectiles = [Projectile(bullet_animations, _random_pos(rng),
+                                  Projectile.calculate_proj_velocity(pygame.Vector2(rng.uniform(-1, 1),
+                                                                                    rng.uniform(-1, 1)),
+                                                                     pygame.Vector2(0, 0), 40),
+                                  damage=100)
+                       for _ in range(count)]
+        start = timeit.default_timer()
+        for _ in range(ticks):
+            for proj in projectiles:
+                if not proj.to_remove:
+                    update(proj, dt, platform_index)
+        elapsed = timeit.default_timer() - start
+        return sum(proj.to_remove for proj in projectiles), elapsed / ticks * 1000
+
+    print(f"{'dt':>6} {'end position hits':>18} {'swept hits':>11} {'end position ms':>16} {'swept ms':>9}")
+    for dt in dts:
+        end_hits, end_ms = fire(dt, _end_position_update)
+        swept_hits, swept_ms = fire(dt, lambda proj, dt, index: proj.update(dt, index))
+        print(f"{dt:>6} {end_hits:>18} {swept_hits:>11} {end_ms:>16.2f} {swept_ms:>9.2f}")
+    print(f"{count} projectiles at speed 40 over {ticks} ticks against 500 300x8 platforms")
+
+
+def bench_terrain(counts=(10, 100, 1000, 5000), soldier_count=200, repeats=5):
+    print(f"{'terrain':>10} {'full scan ms':>16} {'terrain index ms':>16} {'speedup':>8}")
+    for count in counts:
+        terrain, enemies, _ = collision_world(enemy_count=soldier_count, projectile_count=0, terrain_count=count)
+        all_terrain = _AllTargets(terrain)
+        terrain_index = SpatialHash(terrain)
+
+        def full_scan_tick():
+            for enemy in enemies:
+                enemy.update_pos(1, all_terrain)
+
+        def terrain_index_tick():
+            for enemy in enemies:
+                enemy.update_pos(1, terrain_index)
+
+        full = min(timeit.repeat(full_scan_tick, number=1, repeat=repeats)) * 1000
+        indexed = min(timeit.repeat(terrain_index_tick, number=1, repeat=repeats)) * 1000
+        print(f"{count:>10} {full:>16.2f} {indexed:>16.2f} {full / indexed:>7.1f}x")
+
+
+def bench_crowd(counts=(100, 1000, 5000), ticks=50):
+    from crowds import AssaultSoldierCrowd, SightQueries
+    from scheduling import EnemyScheduler
+    print(f"{'soldiers':>10} {'per object ms':>16} {'crowd ms':>16} {'speedup':>8} {'max deviation':>14}")
+    for count in counts:
+        random.seed(0)
+        terrain, soldiers, _ = collision_world(enemy_count=count, projectile_count=0, terrain_count=count // 10)
+        random.seed(0)
+        _, crowd_soldiers, _ = collision_world(enemy_count=count, projectile_count=0, terrain_count=count // 10)
+        terrain_index = SpatialHash(terrain)
+        crowd = AssaultSoldierCrowd(crowd_soldiers)
+        scheduler = EnemyScheduler(soldiers)
+        sight = SightQueries()
+        player_pos = pygame.Vector2(WORLD_WIDTH / 2, WORLD_HEIGHT / 2)
+        per_object = crowd_time = 0
+        for tick in range(1, ticks + 1):
+            start = timeit.default_timer()
+            scheduler.update(1, tick, terrain_index, player_pos, sight)
+            per_object += timeit.default_timer() - start
+            start = timeit.default_timer()
+            crowd.update(1, terrain_index, player_pos, tick)
+            crowd_time += timeit.default_timer() - start
+        deviation = max(abs(a.x - b.x) + abs(a.y - b.y) for a, b in zip(soldiers, crowd.soldiers))
+        per_object, crowd_time = per_object / ticks * 1000, crowd_time / ticks * 1000
+        print(f"{count:>10} {per_object:>16.2f} {crowd_time:>16.2f} {per_object / crowd_time:>7.1f}x "
+              f"{deviation:>14.2g}")
+
+
+def bench_sight(counts=(100, 1000, 10000), ticks=50, seed=0):
+    import numpy as np
+    from crowds import SightQueries, _TerrainGrid
+    # Vector2 range is the old per soldier distance_to check alone, batched adds the line of sight raycasts
+    print(f"{'soldiers':>10} {'Vector2 range ms':>16} {'batched ms':>11} {'rays/tick':>10} "
+          f"{'still ms':>9} {'rays/tick':>10}")
+    for count in counts:
+        rng = random.Random(seed)
+        terrain, soldiers, _ = collision_world(enemy_count=count, projectile_count=0, terrain_count=count // 10)
+        grid = _TerrainGrid(*_TerrainGrid.terrain_arrays(terrain))
+        centers = [pygame.Vector2(s.hitbox.center) for s in soldiers]
+        x = np.array([c.x for c in centers])
+        y = np.array([c.y for c in centers])
+        ranges = np.full(count, 400.0)
+        # The player crosses the world, so everyone ends up near it at some point
+        targets = [pygame.Vector2(WORLD_WIDTH * tick / ticks, rng.uniform(0, WORLD_HEIGHT)) for tick in range(ticks)]
+
+        def per_object():
+            for target in targets:
+                [c.distance_to(target) < 400 for c in centers]
+
+        def batched(moving):
+            sight = SightQueries()
+            for tick, target in enumerate(targets):
+                sight.query(grid, x + tick * moving, y, ranges, target.x, target.y)
+            return sight.rays_cast / ticks
+
+        def still_target():
+            # Nothing moves, so after the first tick every answer comes from the cache
+            sight = SightQueries()
+            for _ in targets:
+                sight.query(grid, x, y, ranges, WORLD_WIDTH / 2, WORLD_HEIGHT / 2)
+            return sight.rays_cast / ticks
+
+        per_object_ms = min(timeit.repeat(per_object, number=1, repeat=3)) / ticks * 1000
+        batched_ms = min(timeit.repeat(lambda: batched(1), number=1, repeat=3)) / ticks * 1000
+        still_ms = min(timeit.repeat(still_target, number=1, repeat=3)) / ticks * 1000
+        print(f"{count:>10} {per_object_ms:>16.3f} {batched_ms:>11.3f} {batched(1):>10.1f} "
+              f"{still_ms:>9.3f} {still_target():>10.1f}")
+
+
+def bench_parallel_crowd(counts=(1000, 10000, 50000), ticks=50, workers=None):
+    from crowds import AssaultSoldierCrowd
+    from parallel_crowds import ParallelAssaultSoldierCrowd
+    workers = workers or os.cpu_count()
+    print(f"{'soldiers':>10} {'crowd ms':>12} {f'{workers} workers ms':>16} {'speedup':>8}")
+    for count in counts:
+        terrain, soldiers, _ = collision_world(enemy_count=count, projectile_count=0, terrain_count=count // 10)
+        _, parallel_soldiers, _ = collision_world(enemy_count=count, projectile_count=0, terrain_count=count // 10)
+        terrain_index = SpatialHash(terrain)
+        player_pos = pygame.Vector2(WORLD_WIDTH / 2, WORLD_HEIGHT / 2)
+        crowd = AssaultSoldierCrowd(soldiers)
+        parallel = ParallelAssaultSoldierCrowd(parallel_soldiers, workers=workers)
+        crowd_ticks, parallel_ticks = itertools.count(1), itertools.count(1)
+        parallel.update(1, terrain_index, player_pos, next(parallel_ticks))
+        crowd.update(1, terrain_index, player_pos, next(crowd_ticks))
+        crowd_ms = timeit.timeit(lambda: crowd.update(1, terrain_index, player_pos, next(crowd_ticks)),
+                                 number=ticks) / ticks * 1000
+        parallel_ms = timeit.timeit(lambda: parallel.update(1, terrain_index, player_pos, next(parallel_ticks)),
+                                    number=ticks) / ticks * 1000
+        parallel.close()
+        print(f"{count:>10} {crowd_ms:>12.2f} {parallel_ms:>16.2f} {crowd_ms / parallel_ms:>7.1f}x")
+
+
+def bench_scheduler(counts=(1000, 5000, 20000), ticks=200, seed=0):
+    import math
+    from crowds import SightQueries
+    from scheduling import EnemyScheduler
+
+    def floored_world(count):
+        random.seed(seed)
+        terrain, soldiers, _ = collision_world(enemy_count=count, projectile_count=0, terrain_count=count // 10,
+                                               seed=seed)
+        terrain.append(Terrain(animations=_animations('neutral', size=(WORLD_WIDTH, 100)),
+                               initial_pos=pygame.Vector2(0, WORLD_HEIGHT)))
+        return SpatialHash(terrain), soldiers
+
+    def run(count, dormant_distance, dt=1, ticks=ticks):
+        terrain_index, soldiers = floored_world(count)
+        scheduler = EnemyScheduler(soldiers)
+        scheduler.dormant_distance = dormant_distance
+        sight = SightQueries()
+        player_pos = pygame.Vector2(WORLD_WIDTH / 2, WORLD_HEIGHT - 50)
+        # Everyone lands first, the player is low enough that the soldiers near it can see it
+        for tick in range(1, 60):
+            scheduler.update(1, tick, terrain_index, player_pos, sight)
+        shots = 0
+        start = timeit.default_timer()
+        for tick in range(ticks):
+            shots += len(scheduler.update(dt, 60 + tick * dt, terrain_index, player_pos, sight))
+        return (timeit.default_timer() - start) / ticks * 1000, scheduler.active_count, shots
+
+    print(f"{'soldiers':>10} {'every tick ms':>14} {'scheduled ms':>13} {'active':>8} {'speedup':>8}")
+    for count in counts:
+        every_ms, _, _ = run(count, math.inf)
+        scheduled_ms, active, _ = run(count, EnemyScheduler.dormant_distance)
+        print(f"{count:>10} {every_ms:>14.2f} {scheduled_ms:>13.2f} {active:>8} {every_ms / scheduled_ms:>7.1f}x")
+    # Shots follow game time, so the same stretch of it gives the same shots at any frame rate
+    print(f"{'dt':>10} {'shots per 600 game time':>24}")
+    for dt in (0.25, 1, 2):
+        print(f"{dt:>10} {run(counts[0], EnemyScheduler.dormant_distance, dt, int(600 / dt))[2]:>24}")
+
+
+def bench_projectile_pool(ticks=500, shots_per_tick=50, lifetime=40):
+    bullet_animations = _animations('neutral', size=(3, 3))
+    start_pos = pygame.Vector2(0, 0)
+    velocity = pygame.Vector2(40, 0)
+
+    def heavy_fire(spawn, release):
+        alive = []
+        born = {}
+        collections = sum(stat['collections'] for stat in gc.get_stats())
+        start = timeit.default_timer()
+        for tick in range(ticks):
+            for _ in range(shots_per_tick):
+                proj = spawn(bullet_animations, start_pos, velocity, 10)
+                born[proj] = tick
+                alive.append(proj)
+            for proj in alive:
+                proj.update(1)
+                proj.to_remove = tick - born[proj] >= lifetime
+            release(p for p in alive if p.to_remove)
+            alive[:] = [p for p in alive if not p.to_remove]
+        elapsed = timeit.default_timer() - start
+        return elapsed, sum(stat['collections'] for stat in gc.get_stats()) - collections
+
+    pool = ProjectilePool()
+    unpooled = ProjectilePool()
+    unpooled_time, unpooled_gcs = heavy_fire(unpooled.get, lambda dead: None)
+    pooled_time, pooled_gcs = heavy_fire(pool.get, pool.release)
+    shots = ticks * shots_per_tick
+    print(f"{'':>10} {'ms':>10} {'allocated':>10} {'alloc/tick':>10} {'reused':>10} {'gc runs':>10}")
+    print(f"{'unpooled':>10} {unpooled_time * 1000:>10.1f} {unpooled.created:>10} {unpooled.created / ticks:>10.1f} "
+          f"{unpooled.reused:>10} {unpooled_gcs:>10}")
+    print(f"{'pooled':>10} {pooled_time * 1000:>10.1f} {pool.created:>10} {pool.created / ticks:>10.1f} "
+          f"{pool.reused:>10} {pooled_gcs:>10}")
+    print(f"{shots} shots fired")
+
+
+def bench_entity_removal(count=50000, removals=(0, 10, 1000), ticks=20):
+    print(f"{'removed/tick':>12} {'list rebuild ms':>16} {'entity list ms':>16}")
+    for removed_per_tick in removals:
+        _, _, projectiles = collision_world(enemy_count=0, projectile_count=count + removed_per_tick * ticks)
+        rebuilt = projectiles[:]
+        entity_list = EntityList(projectiles)
+        rebuild_time = entity_list_time = 0
+        for tick in range(ticks):
+            for proj in projectiles[tick * removed_per_tick:(tick + 1) * removed_per_tick]:
+                proj.to_remove = True
+            start = timeit.default_timer()
+            rebuilt[:] = [p for p in rebuilt if not p.to_remove]
+            rebuild_time += timeit.default_timer() - start
+            start = timeit.default_timer()
+            entity_list.remove_flagged()
+            entity_list_time += timeit.default_timer() - start
+        print(f"{removed_per_tick:>12} {rebuild_time / ticks * 1000:>16.3f} {entity_list_time / ticks * 1000:>16.3f}")
+
+
+def bench_update_loop(counts=(0, 100, 1000), ticks=300):
+    import headless
+    print(f"{'requested':>10} {'enemies':>10} {'ticks/s':>10} "
+          + " ".join(f"{phase + ' ms':>14}" for phase in headless.PHASES))
+    for count in counts:
+        report = headless.run(ticks=ticks, enemies=count)
+        print(f"{report['requested_enemies']:>10} {report['enemies']:>10} {report['ticks_per_second']:>10.1f} "
+              + " ".join(f"{report['phase_ms'][phase]:>14.3f}" for phase in headless.PHASES))
+
+
+def draw_world(count, seed=0):
+    terrain, enemies, projectiles = collision_world(enemy_count=count, projectile_count=count,
+                                                    terrain_count=count // 10, seed=seed)
+    player_animations = _animations('neutral', 'fly_neutral', 'fly_left', 'fly_right', size=(18, 48))
+    state = GameState(player=Player(animations=player_animations, initial_pos=_random_pos(random.Random(seed))),
+                      clock=pygame.time.Clock(),
+                      enemies=enemies,
+                      player_projectiles=projectiles,
+                      terrain=terrain,
+                      background_layers={0: []},
+                      hud=Hud(pygame.font.Font(None, 20)))
+    state.enemy_index = SpatialHash(state.enemies)
+    return state
+
+
+def bench_draw(counts=(100, 1000, 10000), repeats=20):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    from drawing import draw
+    pygame.init()
+    screen = pygame.display.set_mode((960, 720))
+    print(f"{'entities':>10} {'draw ms':>10}")
+    for count in counts:
+        state = draw_world(count)
+        elapsed = min(timeit.repeat(lambda: draw(screen, state), number=1, repeat=repeats)) * 1000
+        print(f"{count:>10} {elapsed:>10.2f}")
+    pygame.quit()
+
+
+def bench_pipeline(counts=(100, 1000, 5000), seconds=2):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import headless
+    import valkyrie
+    from drawing import draw, present
+    from pipeline import SimulationThread
+    pygame.init()
+    screen = pygame.display.set_mode((960, 720))
+    inputs = valkyrie.Inputs(headless.PressedKeys([]), False, (480, 360))
+
+    def level_update(dt, game_state):
+        game_state.increment_timers(dt)
+
+    print(f"{'entities':>10} {'serial fps':>11} {'pipelined fps':>14} {'sim ticks/s':>12}")
+    for count in counts:
+        state = draw_world(count)
+        state.in_cutscene = False
+        frames, end = 0, timeit.default_timer() + seconds
+        while timeit.default_timer() < end:
+            valkyrie.update(state, level_update, inputs, 1)
+            draw(screen, state)
+            frames += 1
+        serial = frames / seconds
+
+        state = draw_world(count)
+        state.in_cutscene = False
+        simulation = SimulationThread(state, level_update, inputs)
+        ticks = [0]
+        publish = simulation.frames.publish
+
+        def counted_publish(frame):
+            ticks[0] += 1
+            publish(frame)
+
+        simulation.frames.publish = counted_publish
+        simulation.start()
+        frame, frames, end = None, 0, timeit.default_timer() + seconds
+        while timeit.default_timer() < end:
+            frame = simulation.frames.wait_newer(frame, timeout=0.1)
+            present(screen, frame, state, 0)
+            frames += 1
+        simulation.stop()
+        print(f"{count:>10} {serial:>11.1f} {frames / seconds:>14.1f} {ticks[0] / seconds:>12.1f}")
+    pygame.quit()
+
+
+def bench_hud(frames=2000, fps_changes_per_second=20):
+    pygame.init()
+    font = pygame.font.Font(None, 20)
+    hud = Hud(font)
+    # A frame every 2ms, with the fps value changing fps_changes_per_second times a second
+    frame_values = [(frame * 2, f"{frame * 2 * fps_changes_per_second // 1000 % 50 + 450:.2f} fps")
+                    for frame in range(frames)]
+
+    def uncached():
+        for _, text in frame_values:
+            font.render(text, True, (0, 255, 0))
+
+    def cached():
+        for now, text in frame_values:
+            hud.throttled('fps', text, now)
+            hud.render("health 1000")
+
+    print(f"{'render every frame ms':>22} {'hud ms':>10}")
+    print(f"{min(timeit.repeat(uncached, number=1, repeat=5)) * 1000:>22.2f} "
+          f"{min(timeit.repeat(cached, number=1, repeat=5)) * 1000:>10.2f}")
+
+
+def bench_snapshot(counts=(100, 1000, 10000), repeats=5):
+    import copy
+    from crowds import AssaultSoldierCrowd
+    from snapshots import Snapshot
+    pygame.init()
+    print(f"{'entities':>10} {'take ms':>10} {'crowd take ms':>14} {'restore ms':>11} {'bytes':>10} "
+          f"{'deepcopy ms':>12}")
+    for count in counts:
+        state = draw_world(count)
+        snapshot = Snapshot.take(state)
+        take = min(timeit.repeat(lambda: Snapshot.take(state), number=1, repeat=repeats)) * 1000
+        restore = min(timeit.repeat(lambda: snapshot.restore(state), number=1, repeat=repeats)) * 1000
+        # The same soldiers in a crowd, whose arrays are read directly
+        state.enemy_crowd = AssaultSoldierCrowd(state.enemies)
+        crowd_take = min(timeit.repeat(lambda: Snapshot.take(state), number=1, repeat=repeats)) * 1000
+        state.enemy_crowd.load([])
+        state.enemy_crowd = None
+
+        def deepcopy():
+            # Shares the animations and terrain like a snapshot does, so only the entities themselves are copied
+            memo = {id(state.terrain): state.terrain, id(state.terrain_index): state.terrain_index}
+            sprites = [state.player.sprite, *(e.sprite for e in state.enemies), *state.player_projectiles]
+            for animations in {id(sprite.animations): sprite.animations for sprite in sprites}.values():
+                memo[id(animations)] = animations
+                memo.update({id(animation): animation for animation in animations.values()})
+            copy.deepcopy([state.player, state.enemies, state.player_projectiles], memo)
+
+        copied = min(timeit.repeat(deepcopy, number=1, repeat=repeats)) * 1000
+        print(f"{count:>10} {take:>10.3f} {crowd_take:>14.3f} {restore:>11.3f} {len(snapshot):>10} {copied:>12.2f}")
+
+
+def bench_background(frames=500):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    screen = pygame.display.set_mode((960, 720))
+
+    def layer(size, pos, z):
+        image = pygame.Surface(size, pygame.SRCALPHA)
+        image.fill((80, 120, 160, 255), (0, size[1] // 2, size[0], size[1] // 2))
+        return Background({'neutral': Animation('neutral', [image], [1234])}, pygame.Vector2(pos), z)
+
+    layers = {}
+    for bg in [layer((960, 720), (0, 0), 0),
+               layer((2000, 600), (-50, 50), 15),
+               layer((2000, 600), (-50, 50), 30),
+               layer((373, 120), (400, 1090), 1),
+               layer((373, 120), (773, 1090), 1)]:
+        layers.setdefault(bg.z, []).append(bg)
+    cameras = [pygame.Vector2(320 + i * 3, 550 - i) for i in range(frames)]
+
+    def per_frame_blits():
+        for camera in cameras:
+            screen.fill((123, 123, 123))
+            for bg in layers[0]:
+                bg.draw(screen, camera)
+            for z in reversed(sorted(layers.keys())):
+                if z > 0:
+                    for bg in layers[z]:
+                        bg.draw(screen, camera)
+
+    background = ParallaxBackground(layers)
+
+    def cached_strips():
+        for camera in cameras:
+            screen.blits(background.blit_args(camera, screen.get_size()), doreturn=False)
+
+    for name, func in [('per frame', per_frame_blits), ('cached strips', cached_strips)]:
+        elapsed = min(timeit.repeat(func, number=1, repeat=3)) / frames * 1000
+        print(f"{name:>14} {elapsed:8.3f} ms/frame")
+    pygame.quit()
+
+
+def bench_animation(count=5000, ticks=100):
+    durations = [18] * 12
+
+    def sliced_sum_next_frame(state):
+        # The per-call lookup Animation used before frame ends were precomputed
+        state[0] += 1
+        if state[0] > sum(durations[:state[1] + 1]):
+            if state[0] > sum(durations):
+                state[0] = state[1] = 0
+            else:
+                state[1] += 1
+
+    states = [[0, 0] for _ in range(count)]
+    animation = Animation('neutral', [pygame.Surface((4, 4))] * len(durations), durations)
+
+    def sliced_sum():
+        for state in states:
+            sliced_sum_next_frame(state)
+
+    def precomputed():
+        for state in states:
+            state[0], state[1] = animation.advance(state[0], state[1], 1)
+
+    for name, func in [('sliced sum', sliced_sum), ('precomputed', precomputed)]:
+        elapsed = min(timeit.repeat(func, number=ticks, repeat=3)) / ticks * 1000
+        print(f"{name:>12} {elapsed:8.3f} ms/tick for {count} sprites")
+
+
+def bench_entity_memory(count=20000, ticks=20):
+    import tracemalloc
+    rng = random.Random(0)
+    positions = [_random_pos(rng) for _ in range(count)]
+    bullet_animations = _animations('neutral', size=(3, 3))
+    soldier_animations = _animations('face_right', 'face_left')
+    soldier_animations['projectile'] = _animations('neutral', size=(6, 6))
+    terrain_animations = _animations('neutral', size=(50, 50))
+    empty_index = SpatialHash()
+    player_pos = pygame.Vector2(0, 0)
+    kinds = [
+        ('projectile',
+         lambda pos: Projectile(bullet_animations, pos, pygame.Vector2(3, 1), 10),
+         lambda p: p.update(1)),
+        ('soldier',
+         lambda pos: AssaultSoldier(initial_pos=pos, animations=soldier_animations),
+         lambda e: e.update(1, empty_index, player_pos, False, 0)),
+        ('terrain',
+         lambda pos: Terrain(animations=terrain_animations, initial_pos=pos),
+         None),
+    ]
+
+    print(f"{'entity':>10} {'bytes each':>12} {'x/y/hitbox ms':>14} {'update ms':>10}")
+    for name, create, update in kinds:
+        gc.collect()
+        tracemalloc.start()
+        entities = [create(pygame.Vector2(pos)) for pos in positions]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        def access():
+            for entity in entities:
+                entity.x, entity.y, entity.hitbox
+
+        def update_all():
+            for entity in entities:
+                update(entity)
+
+        access_ms = min(timeit.repeat(access, number=ticks, repeat=3)) / ticks * 1000
+        update_ms = min(timeit.repeat(update_all, number=ticks, repeat=3)) / ticks * 1000 if update else 0
+        print(f"{name:>10} {size / count:>12.0f} {access_ms:>14.3f} {update_ms:>10.3f}")
+    print(f"{count} of each entity")
+
+
+BENCHMARKS = {
+    'collision': bench_collision,
+    'projectile_sweep': bench_projectile_sweep,
+    'terrain': bench_terrain,
+    'crowd': bench_crowd,
+    'sight': bench_sight,
+    'parallel_crowd': bench_parallel_crowd,
+    'scheduler': bench_scheduler,
+    'projectile_pool': bench_projectile_pool,
+    'entity_removal': bench_entity_removal,
+    'update_loop': bench_update_loop,
+    'draw': bench_draw,
+    'pipeline': bench_pipeline,
+    'hud': bench_hud,
+    'snapshot': bench_snapshot,
+    'background': bench_background,
+    'animation': bench_animation,
+    'entity_memory': bench_entity_memory,
+}
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+import pygame
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def sweep_rect(left: int, top: int, width: int, height: int, dx: float, dy: float,
+               target: pygame.Rect) -> Optional[float]:
+    # The earliest fraction of the move by (dx, dy) at which the rect overlaps target, or None if it never does.
+    # Overlap is strict, as with Rect.colliderect, so at a fraction of 1 this is the same test made after the move
+    entry, leave = 0, float('inf')
+    if dx:
+        t0, t1 = (target.left - width - left) / dx, (target.right - left) / dx
+        if t0 > t1:
+            t0, t1 = t1, t0
+        entry, leave = max(entry, t0), min(leave, t1)
+    elif not (left < target.right and left + width > target.left):
+        return None
+    if dy:
+        t0, t1 = (target.top - height - top) / dy, (target.bottom - top) / dy
+        if t0 > t1:
+            t0, t1 = t1, t0
+        entry, leave = max(entry, t0), min(leave, t1)
+    elif not (top < target.bottom and top + height > target.top):
+        return None
+    return entry if entry < leave and entry < 1 else None
+
+
+class SpatialHash:
+    def __init__(self, objects: Iterable = (), cell_size: int = 128):
+        self.cell_size = cell_size
+        self._objects = []
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        for obj in objects:
+            self.insert(obj)
+
+    def _cell_range(self, rect: pygame.Rect):
+        size = self.cell_size
+        return (range(rect.left // size, (rect.right - 1) // size + 1),
+                range(rect.top // size, (rect.bottom - 1) // size + 1))
+
+    def insert(self, obj):
+        index = len(self._objects)
+        self._objects.append(obj)
+        xs, ys = self._cell_range(obj.hitbox)
+        for cx in xs:
+            for cy in ys:
+                self._cells.setdefault((cx, cy), []).append(index)
+
+    def clear(self):
+        self._objects.clear()
+        self._cells.clear()
+
+    def query(self, rect: pygame.Rect) -> List:
+        xs, ys = self._cell_range(rect)
+        cells = self._cells
+        found = set()
+        for cx in xs:
+            for cy in ys:
+                cell = cells.get((cx, cy))
+                if cell:
+                    found.update(cell)
+        # Candidates come back in insertion order so that callers which stop at the first hit behave
+        # exactly as they would when scanning the full list
+        objects = self._objects
+        return [objects[i] for i in sorted(found)]
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __iter__(self):
+        return iter(self._objects)
@@ -0,0 +1,417 @@
+import math
+
+import numpy as np
+import pygame
+
+from game_objects import gravity
+from scheduling import EnemyScheduler
+
+
+def _rect_round(values):
+    # Rect attribute assignment rounds halves away from zero, unlike round() which rounds them to even
+    return np.where(values >= 0, np.floor(values + 0.5), np.ceil(values - 0.5))
+
+
+class _TerrainGrid:
+    cell_size = 128
+
+    def __init__(self, rects, platform):
+        rects = np.asarray(rects, dtype=int).reshape(-1, 4)
+        self.left = rects[:, 0]
+        self.top = rects[:, 1]
+        self.right = rects[:, 0] + rects[:, 2]
+        self.bottom = rects[:, 1] + rects[:, 3]
+        self.platform = np.asarray(platform, dtype=bool)
+
+        keys, owners = [], []
+        for i, (left, top, right, bottom) in enumerate(zip(self.left, self.top, self.right, self.bottom)):
+            for cx in range(left // self.cell_size, (right - 1) // self.cell_size + 1):
+                for cy in range(top // self.cell_size, (bottom - 1) // self.cell_size + 1):
+                    keys.append(self._key(cx, cy))
+                    owners.append(i)
+        order = np.argsort(np.array(keys, dtype=np.int64), kind='stable')
+        self.cell_keys = np.array(keys, dtype=np.int64)[order]
+        self.cell_pieces = np.array(owners, dtype=int)[order]
+
+    @staticmethod
+    def terrain_arrays(terrain):
+        pieces = list(terrain)
+        return [tuple(t.hitbox) for t in pieces], [t.platform for t in pieces]
+
+    @staticmethod
+    def _key(cx, cy):
+        return (np.int64(cx) << 32) + (np.int64(cy) + (1 << 31))
+
+    def candidates(self, left, top, right, bottom):
+        # Returns (soldier, piece) index pairs whose rects overlap, sorted by soldier and then by terrain order
+        if not len(self.left):
+            return np.empty(0, dtype=int), np.empty(0, dtype=int)
+        size = self.cell_size
+        cx0, cy0 = left // size, top // size
+        span_x, span_y = (right - 1) // size - cx0, (bottom - 1) // size - cy0
+        owners, keys = [], []
+        for ox in range(span_x.max() + 1):
+            for oy in range(span_y.max() + 1):
+                covered = np.flatnonzero((ox <= span_x) & (oy <= span_y))
+                owners.append(covered)
+                keys.append(self._key(cx0[covered] + ox, cy0[covered] + oy))
+        owners, keys = np.concatenate(owners), np.concatenate(keys)
+
+        first = np.searchsorted(self.cell_keys, keys, 'left')
+        counts = np.searchsorted(self.cell_keys, keys, 'right') - first
+        soldier = np.repeat(owners, counts)
+        starts = np.repeat(first - np.cumsum(counts) + counts, counts)
+        piece = self.cell_pieces[np.arange(len(soldier)) + starts]
+
+        pairs = np.unique(soldier * len(self.left) + piece)
+        soldier, piece = np.divmod(pairs, len(self.left))
+        overlapping = (self.left[piece] < right[soldier]) & (self.right[piece] > left[soldier]) \
+            & (self.top[piece] < bottom[soldier]) & (self.bottom[piece] > top[soldier])
+        return soldier[overlapping], piece[overlapping]
+
+    def blocks_sight(self, x0, y0, x1, y1):
+        # Whether a solid piece crosses the segment from each (x0, y0) to (x1, y1), the end can be one shared point.
+        # Platforms can be seen through
+        blocked = np.zeros(len(x0), dtype=bool)
+        if not len(x0):
+            return blocked
+        dx, dy = x1 - x0, y1 - y0
+        soldier, piece = self.candidates(np.floor(np.minimum(x0, x1)).astype(int),
+                                         np.floor(np.minimum(y0, y1)).astype(int),
+                                         np.floor(np.maximum(x0, x1)).astype(int) + 1,
+                                         np.floor(np.maximum(y0, y1)).astype(int) + 1)
+        solid = ~self.platform[piece]
+        soldier, piece = soldier[solid], piece[solid]
+
+        # Slab test, where entry < leave means part of the segment is strictly inside the piece
+        entry, leave = np.zeros(len(soldier)), np.ones(len(soldier))
+        for origin, delta, low, high in ((x0[soldier], dx[soldier], self.left[piece], self.right[piece]),
+                                         (y0[soldier], dy[soldier], self.top[piece], self.bottom[piece])):
+            moving = delta != 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t0, t1 = (low - origin) / delta, (high - origin) / delta
+            inside = (low < origin) & (origin < high)
+            entry = np.maximum(entry, np.where(moving, np.minimum(t0, t1), np.where(inside, -np.inf, np.inf)))
+            leave = np.minimum(leave, np.where(moving, np.maximum(t0, t1), np.inf))
+        blocked[soldier[entry < leave]] = True
+        return blocked
+
+
+# Range and line of sight from a batch of points to one target. Only the points within range are raycast against the
+# terrain, and a point keeps the previous query's answer while neither it nor the target has moved.
+class SightQueries:
+    def __init__(self):
+        self._terrain_source = None
+        self._terrain_grid = None
+        self._last = None
+        self.rays_cast = 0
+
+    def grid(self, terrain):
+        if terrain is not self._terrain_source:
+            self._terrain_source = terrain
+            self._terrain_grid = _TerrainGrid(*_TerrainGrid.terrain_arrays(terrain))
+        return self._terrain_grid
+
+    def query(self, grid, x, y, ranges, target_x, target_y, wanted=True):
+        dx, dy = x - target_x, y - target_y
+        checked = wanted & (np.sqrt(dx * dx + dy * dy) < ranges)
+        sees = np.zeros(len(x), dtype=bool)
+        cast = checked
+        last = self._last
+        if last is not None and last[:3] == (grid, target_x, target_y) and len(last[3]) == len(x):
+            _, _, _, last_x, last_y, last_checked, last_sees = last
+            reuse = checked & last_checked & (x == last_x) & (y == last_y)
+            sees[reuse] = last_sees[reuse]
+            cast = checked & ~reuse
+        cast = np.flatnonzero(cast)
+        sees[cast] = ~grid.blocks_sight(x[cast], y[cast], target_x, target_y)
+        self.rays_cast += len(cast)
+        self._last = (grid, target_x, target_y, x, y, checked, sees)
+        return sees
+
+    def enemies_in_sight(self, enemies, terrain, target):
+        # For soldiers updated one at a time: which of them are ready to open fire on target this tick
+        centers = np.array([e.hitbox.center for e in enemies], dtype=int).reshape(-1, 2)
+        ranges = np.fromiter((e.range for e in enemies), dtype=float, count=len(enemies))
+        idle = np.fromiter((not e.shooting_at for e in enemies), dtype=bool, count=len(enemies))
+        return self.query(self.grid(terrain), centers[:, 0], centers[:, 1], ranges, target.x, target.y, idle)
+
+
+_COLUMNS = [
+    ('x', float, lambda s: s.x),
+    ('y', float, lambda s: s.y),
+    ('x_vel', float, lambda s: s.x_vel),
+    ('y_vel', float, lambda s: s.y_vel),
+    ('move_speed', float, lambda s: s.move_speed),
+    ('drag', float, lambda s: s.drag),
+    ('max_step', float, lambda s: s.max_step),
+    ('range', float, lambda s: s.range),
+    ('health', float, lambda s: s.health),
+    ('hb_left', int, lambda s: s.hitbox.left),
+    ('hb_top', int, lambda s: s.hitbox.top),
+    ('hb_width', int, lambda s: s.hitbox.width),
+    ('hb_height', int, lambda s: s.hitbox.height),
+    ('right_width', int, lambda s: s.sprite.animations['face_right'].hitbox_size.x),
+    ('right_height', int, lambda s: s.sprite.animations['face_right'].hitbox_size.y),
+    ('left_width', int, lambda s: s.sprite.animations['face_left'].hitbox_size.x),
+    ('left_height', int, lambda s: s.sprite.animations['face_left'].hitbox_size.y),
+    ('moving_right', bool, lambda s: s.moving_right),
+    ('in_air', bool, lambda s: s.in_air),
+    ('force_dropping', bool, lambda s: s.force_dropping),
+    ('shooting', bool, lambda s: bool(s.shooting_at)),
+    ('target_x', float, lambda s: s.shooting_at.x if s.shooting_at else 0),
+    ('target_y', float, lambda s: s.shooting_at.y if s.shooting_at else 0),
+    ('shots_in_burst', int, lambda s: s.shots_in_burst),
+    ('shots_fired', int, lambda s: s.shots_fired),
+    ('fire_delay', float, lambda s: s.fire_delay),
+    ('pre_fire_delay', float, lambda s: s.pre_fire_delay),
+    ('next_shot_at', float, lambda s: s.next_shot_at),
+    ('updated_at', float, lambda s: math.nan if s.updated_at is None else s.updated_at),
+    ('dormant', bool, lambda s: s.dormant),
+]
+
+
+def soldier_columns(soldiers):
+    return {name: np.fromiter((attr(s) for s in soldiers), dtype=dtype, count=len(soldiers))
+            for name, dtype, attr in _COLUMNS}
+
+
+# The state of a group of AssaultSoldiers as one array per attribute, and the batched update over it. Nothing here
+# refers to the soldier objects, so it can run anywhere the arrays are.
+class SoldierArrays:
+    def __init__(self, columns):
+        self.columns = list(columns)
+        for name, values in columns.items():
+            setattr(self, name, values)
+        self.sight = SightQueries()
+
+    def __len__(self):
+        return len(self.x)
+
+    def compact(self, alive):
+        for name in self.columns:
+            setattr(self, name, getattr(self, name)[alive])
+
+    def knock_back(self, i, damage, to_right):
+        knockback = damage / 20
+        self.y_vel[i] -= knockback
+        self.x_vel[i] = knockback if to_right else -knockback
+
+    def rows(self, mask):
+        return SoldierArrays({name: getattr(self, name)[mask] for name in self.columns})
+
+    def set_rows(self, mask, rows):
+        for name in self.columns:
+            getattr(self, name)[mask] = getattr(rows, name)
+
+    def step(self, dt, grid, player_x, player_y, now):
+        # Dormant soldiers sit out until dormant_interval has passed, as with EnemyScheduler, so only the rows that are
+        # due are stepped. Returns which soldiers fire, and leaves which were stepped and by how much in due and due_dt
+        self.due = ~self.dormant | (now >= self.updated_at + EnemyScheduler.dormant_interval)
+        self.due_dt = np.where(np.isnan(self.updated_at), dt, now - self.updated_at)[self.due]
+        if self.due.all():
+            return self._advance(self.due_dt, grid, player_x, player_y, now, self.sight)
+        due = self.rows(self.due)
+        fires = np.zeros(len(self), dtype=bool)
+        fires[self.due] = due._advance(self.due_dt, grid, player_x, player_y, now, self.sight)
+        self.set_rows(self.due, due)
+        return fires
+
+    def _advance(self, dt, grid, player_x, player_y, now, sight):
+        center_x = self.hb_left + self.hb_width // 2
+        center_y = self.hb_top + self.hb_height // 2
+        starts_shooting = sight.query(grid, center_x, center_y, self.range, player_x, player_y, ~self.shooting)
+        self.moving_right = np.where(starts_shooting, self.moving_right, player_x > center_x)
+        self.target_x[starts_shooting] = player_x
+        self.target_y[starts_shooting] = player_y
+        self.next_shot_at[starts_shooting] = now + self.pre_fire_delay[starts_shooting] \
+            + self.fire_delay[starts_shooting]
+        self.shooting |= starts_shooting
+        self.hb_width = np.where(self.moving_right, self.right_width, self.left_width)
+        self.hb_height = np.where(self.moving_right, self.right_height, self.left_height)
+
+        # Soldiers catching up after being dormant move in steps of at most max_step
+        steps = np.ceil(dt / self.max_step)
+        step_dt = dt / np.maximum(steps, 1)
+        for n in range(int(steps.max()) if len(steps) else 0):
+            moving = steps > n
+            if moving.all():
+                self._move(step_dt, grid)
+            else:
+                rows = self.rows(moving)
+                rows._move(step_dt[moving], grid)
+                self.set_rows(moving, rows)
+        self.updated_at = np.full(len(self), now, dtype=float)
+
+        dx = self.hb_left + self.hb_width // 2 - player_x
+        dy = self.hb_top + self.hb_height // 2 - player_y
+        distance = EnemyScheduler.dormant_distance
+        self.dormant = ~self.shooting & ~self.in_air & (dx * dx + dy * dy > distance * distance)
+        return self._fire_due(now)
+
+    def _move(self, dt, grid):
+        self.y_vel = self.y_vel + dt * gravity
+        self.y_vel -= self.drag * self.y_vel * dt
+        walking_speed = np.where(self.moving_right, self.move_speed, -self.move_speed)
+        self.x_vel = np.where(self.in_air, self.x_vel, np.where(self.shooting, 0, walking_speed))
+        self._update_pos(dt, grid)
+
+    def _update_pos(self, dt, grid):
+        width = self.hb_width
+        height = self.hb_height
+        new_x = self.x + dt * self.x_vel
+        new_y = self.y + dt * self.y_vel
+        left = self.hb_left
+        top = self.hb_top
+        right = left + width
+        bottom = top + height
+        moved_left = _rect_round(new_x).astype(int)
+        moved_top = _rect_round(new_y).astype(int)
+        x_ok = np.ones(len(self), dtype=bool)
+        y_ok = np.ones(len(self), dtype=bool)
+        in_air = np.ones(len(self), dtype=bool)
+
+        soldier, piece = grid.candidates(np.minimum(left, moved_left) - 1,
+                                         np.minimum(top, moved_top) - 1,
+                                         np.maximum(right, moved_left + width) + 1,
+                                         np.maximum(bottom, moved_top + height) + 1)
+        # Each terrain piece can move the hitbox that later pieces test against, so every soldier has to see its
+        # candidates in terrain order. Round n resolves the n-th candidate of every soldier at once.
+        rank = np.arange(len(soldier)) - np.searchsorted(soldier, soldier)
+        for n in range(rank.max() + 1 if len(rank) else 0):
+            s = soldier[rank == n]
+            p = piece[rank == n]
+            t_left, t_top, t_right, t_bottom = grid.left[p], grid.top[p], grid.right[p], grid.bottom[p]
+            platform = grid.platform[p]
+            w, h, ml, mt = width[s], height[s], moved_left[s], moved_top[s]
+            x_vel, y_vel = self.x_vel[s], self.y_vel[s]
+
+            overlaps_x = (t_left < right[s]) & (t_right > left[s])
+            overlaps_y = ~platform & (t_top < bottom[s]) & (t_bottom > top[s])
+            blocked_right = overlaps_y & (x_vel > 0) & (ml < t_left) & (t_left <= ml + w)
+            blocked_left = overlaps_y & ~blocked_right & (x_vel < 0) & (ml + w > t_right) & (t_right >= ml)
+            ml = np.where(blocked_right, t_left - w, np.where(blocked_left, t_right, ml))
+
+            lands = overlaps_x & (y_vel > 0) & (mt < t_top) & (t_top <= mt + h) \
+                & (~platform | (~self.force_dropping[s] & ~(bottom[s] > t_bottom)))
+            bumps = overlaps_x & ~platform & ~lands & (y_vel < 0) & (mt + h > t_bottom) & (t_bottom > mt)
+            mt = np.where(lands, t_top - h, np.where(bumps, t_bottom, mt))
+
+            moved_left[s] = ml
+            moved_top[s] = mt
+            x_ok[s] &= ~(blocked_right | blocked_left)
+            y_ok[s] &= ~(lands | bumps)
+            in_air[s] &= ~lands
+
+        self.in_air = in_air
+        self.x = np.where(x_ok, new_x, moved_left)
+        self.x_vel = np.where(x_ok, self.x_vel, 0)
+        self.hb_left = np.where(x_ok, np.round(new_x), moved_left).astype(int)
+        self.y = np.where(y_ok, new_y, moved_top)
+        self.y_vel = np.where(y_ok, self.y_vel, 0)
+        self.hb_top = np.where(y_ok, np.round(new_y), moved_top).astype(int)
+
+    def _fire_due(self, now):
+        # At most one shot each per tick, however far behind a soldier's shots are
+        fires = self.shooting & (self.next_shot_at <= now)
+        self.shots_fired[fires] += 1
+        burst_over = fires & (self.shots_fired >= self.shots_in_burst)
+        self.next_shot_at = np.where(burst_over, np.inf,
+                                     np.where(fires, self.next_shot_at + self.fire_delay, self.next_shot_at))
+        self.shooting &= ~burst_over
+        self.shots_fired[burst_over] = 0
+        return fires
+
+
+# Advances a group of AssaultSoldiers in batched numpy operations. While a soldier is in a crowd the crowd owns its
+# movement, burst fire and health; the soldier object only mirrors its position and facing so it can still be drawn
+# and hit by projectiles, and routes the damage it takes back here.
+class AssaultSoldierCrowd(SoldierArrays):
+    def __init__(self, soldiers):
+        self.soldiers = []
+        self.load(soldiers)
+
+    def load(self, soldiers):
+        for soldier in self.soldiers:
+            soldier.crowd = None
+        self.soldiers = list(soldiers)
+        self._indices = {soldier: i for i, soldier in enumerate(self.soldiers)}
+        self._has_dead = False
+        super().__init__(soldier_columns(self.soldiers))
+        for soldier in self.soldiers:
+            soldier.crowd = self
+
+    def take_damage(self, soldier, proj):
+        i = self._indices[soldier]
+        self.health[i] -= proj.damage
+        self.knock_back(i, proj.damage, proj.x_vel > 0)
+        if self.health[i] <= 0:
+            soldier.to_remove = True
+            self._has_dead = True
+
+    def close(self):
+        # Nothing to release, ParallelAssaultSoldierCrowd stops its worker processes here
+        pass
+
+    def health_of(self, soldier):
+        return float(self.health[self._indices[soldier]])
+
+    def rows_of(self, soldiers):
+        # Each soldier's row in the arrays, -1 for soldiers the crowd doesn't hold
+        indices = self._indices
+        return np.fromiter((indices.get(s, -1) for s in soldiers), dtype=int, count=len(soldiers))
+
+    def state_columns(self, names):
+        # The current arrays as they are, without writing them back to the soldier objects
+        return [getattr(self, name) for name in names]
+
+    def _alive(self):
+        return np.fromiter((not s.to_remove for s in self.soldiers), dtype=bool, count=len(self.soldiers))
+
+    def _remove_dead(self, alive):
+        self.compact(alive)
+        for soldier in self.soldiers:
+            if soldier.to_remove:
+                soldier.crowd = None
+        self.soldiers = [s for s in self.soldiers if not s.to_remove]
+        self._indices = {soldier: i for i, soldier in enumerate(self.soldiers)}
+        self._has_dead = False
+
+    def _push_positions(self, due, due_dt):
+        rows = np.flatnonzero(due)
+        for i, dt, x, y, moving_right in zip(rows.tolist(), due_dt.tolist(), self.x[rows].tolist(),
+                                             self.y[rows].tolist(), self.moving_right[rows].tolist()):
+            sprite = self.soldiers[i].sprite
+            sprite.update(dt, "face_right" if moving_right else "face_left")
+            sprite.x = x
+            sprite.y = y
+
+    def write_back(self):
+        # Facing reaches the soldiers with every update, so only positions are pushed here and animations don't advance
+        for soldier, x, y in zip(self.soldiers, self.x.tolist(), self.y.tolist()):
+            soldier.sprite.x = x
+            soldier.sprite.y = y
+        for i, soldier in enumerate(self.soldiers):
+            soldier.x_vel = float(self.x_vel[i])
+            soldier.y_vel = float(self.y_vel[i])
+            soldier.health = float(self.health[i])
+            soldier.in_air = bool(self.in_air[i])
+            soldier.moving_right = bool(self.moving_right[i])
+            soldier.shooting_at = pygame.Vector2(self.target_x[i], self.target_y[i]) if self.shooting[i] else None
+            soldier.shots_fired = int(self.shots_fired[i])
+            soldier.next_shot_at = float(self.next_shot_at[i])
+            soldier.updated_at = None if np.isnan(self.updated_at[i]) else float(self.updated_at[i])
+            soldier.dormant = bool(self.dormant[i])
+
+    def _fire(self, fires):
+        return [self.soldiers[i].fire_gun(pygame.Vector2(self.target_x[i], self.target_y[i]))
+                for i in np.flatnonzero(fires)]
+
+    def update(self, dt, terrain, player_pos, now):
+        if self._has_dead:
+            self._remove_dead(self._alive())
+        if not self.soldiers:
+            return []
+        fires = self.step(dt, self.sight.grid(terrain), player_pos.x, player_pos.y, now)
+        self._push_positions(self.due, self.due_dt)
+        return self._fire(fires)
@@ -1,14 +1,17 @@
 import pygame
-from typing import List, Tuple, Callable
+from typing import Callable, Dict, List, NamedTuple, Tuple
 
-from valkyrie import SCREEN_WIDTH, SCREEN_HEIGHT, DEBUG
+from hud import Hud
+from valkyrie import SCREEN_WIDTH, SCREEN_HEIGHT, DEBUG, DIRTY_RECTS
 
+# Sprites can extend past their hitboxes, so cull against a slightly larger rect than the screen
+CULL_MARGIN = 64
 
-def get_screen_coordinate(screen_center: pygame.Vector2,
-                          camera_center: pygame.Vector2,
-                          point: pygame.Vector2) -> Tuple[int, int]:
-    offset_x, offset_y = screen_center.x - camera_center.x, screen_center.y - camera_center.y
-    return point.x + offset_x, point.y + offset_y
+
+def camera_view(camera_center: pygame.Vector2) -> pygame.Rect:
+    view = pygame.Rect(0, 0, SCREEN_WIDTH + 2 * CULL_MARGIN, SCREEN_HEIGHT + 2 * CULL_MARGIN)
+    view.center = camera_center
+    return view
 
 
 def rect_to_pointlist(rect: pygame.rect,
@@ -19,44 +22,119 @@ def rect_to_pointlist(rect: pygame.rect,
     return [coordinate_convert_func(pygame.Vector2(corner)) for corner in corners]
 
 
-def draw(screen, game_state):
+def profiler_lines(timer):
+    lines = [f"frame p50 {timer.frame_percentile_ms(0.5):.2f} ms  p99 {timer.frame_percentile_ms(0.99):.2f} ms"]
+    lines += [f"{name} {mean:.3f} ms" for name, mean in timer.means_ms().items()]
+    lines += [f"{name} {value}" for name, value in timer.counters.items()]
+    return lines
+
+
+def draw_hud(screen, game_state, fps, health):
+    hud = game_state.hud
+    if hud is None:
+        # Made on first draw rather than with the GameState, which doesn't need the font module to be initialised
+        hud = game_state.hud = Hud(pygame.font.Font(None, 20))
+    now = pygame.time.get_ticks()
+    labels = [hud.throttled('fps', f"{fps:.2f} fps", now),
+              hud.render(f"health {health}")]
+    if game_state.show_profiler:
+        labels += [hud.throttled(('profiler', i), line, now)
+                   for i, line in enumerate(profiler_lines(game_state.phase_timer))]
+    line_height = hud.font.get_linesize()
+    return screen.blits([(label, (0, i * line_height)) for i, label in enumerate(labels)])
+
+
+# Everything present needs from the simulation to draw a frame. Blit positions are already in screen coordinates and
+# the surfaces are the sprites' own frames, which are never drawn on, so a frame can be drawn on another thread while
+# the simulation carries on.
+class RenderFrame(NamedTuple):
+    camera_center: pygame.Vector2
+    layers: List[List[Tuple[pygame.Surface, Tuple[float, float]]]]
+    outlines: List[Tuple[Tuple[int, int, int], List[Tuple[float, float]]]]
+    health: float
+    counters: Dict[str, int]
+
+
+def capture(game_state) -> RenderFrame:
     player = game_state.player
+    alpha = game_state.interpolation_alpha
     screen_center = pygame.Vector2(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
-    camera_center = pygame.math.Vector2(player.x, player.y)
+    camera_center = pygame.math.Vector2(player.sprite.interpolated_pos(alpha))
+    # Where the next update aims the mouse from
     game_state.last_camera_center = camera_center
+    view = camera_view(camera_center)
+    offset_x, offset_y = screen_center.x - camera_center.x, screen_center.y - camera_center.y
 
     def calc_screen_position(point: pygame.Vector2) -> Tuple[int, int]:
-        return get_screen_coordinate(screen_center, camera_center, point)
-
-    screen.fill((123, 123, 123))
-
-    for bg in game_state.background_layers[0]:
-        bg.draw(screen, camera_center)
-
-    for z in reversed(sorted(game_state.background_layers.keys())):
-        if z > 0:
-            for bg in game_state.background_layers[z]:
-                bg.draw(screen, camera_center)
+        return point.x + offset_x, point.y + offset_y
+
+    with game_state.phase_timer.phase('capture'):
+        if game_state.enemy_index is not None:
+            visible_enemies = game_state.enemy_index.query(view)
+        else:
+            visible_enemies = [e for e in game_state.enemies if view.colliderect(e.hitbox)]
+
+        layers = [
+            [t.blit_args(calc_screen_position) for t in game_state.terrain_index.query(view)],
+            [e.blit_args(calc_screen_position, alpha) for e in visible_enemies],
+            [p.blit_args(calc_screen_position, alpha)
+             for p in game_state.enemy_projectiles if view.colliderect(p.hitbox)],
+            [player.blit_args(calc_screen_position, alpha)],
+            [p.blit_args(calc_screen_position, alpha)
+             for p in game_state.player_projectiles if view.colliderect(p.hitbox)],
+        ]
+        outlines = []
+        if DEBUG:
+            outlines.append(((0, 255, 0), rect_to_pointlist(player.hitbox, calc_screen_position)))
+            outlines.extend(((255, 0, 0), rect_to_pointlist(enemy.hitbox, calc_screen_position))
+                            for enemy in visible_enemies)
+
+    counters = {'enemy count': len(game_state.enemies),
+                'projectile count': len(game_state.player_projectiles) + len(game_state.enemy_projectiles),
+                'visible enemy count': len(visible_enemies)}
+    if game_state.enemy_crowd is None:
+        counters['active enemy count'] = game_state.enemy_scheduler.active_count
+    return RenderFrame(camera_center, layers, outlines, player.health, counters)
+
+
+def present(screen, frame, game_state, fps):
+    timer = game_state.phase_timer
+    camera_moved = frame.camera_center != game_state.presented_camera_center
+    game_state.presented_camera_center = frame.camera_center
+
+    with timer.phase('draw background'):
+        background = game_state.background.blit_args(frame.camera_center, screen.get_size())
+        screen.blits(background, doreturn=False)
+
+    with timer.phase('draw sprites'):
+        dirty_rects = []
+        for layer in frame.layers:
+            if DIRTY_RECTS:
+                dirty_rects.extend(screen.blits(layer))
+            else:
+                screen.blits(layer, doreturn=False)
+
+    if frame.outlines:
+        with timer.phase('draw debug'):
+            dirty_rects.extend(pygame.draw.polygon(screen, colour, points, 1) for colour, points in frame.outlines)
+
+    with timer.phase('draw hud'):
+        hud_rects = draw_hud(screen, game_state, fps, frame.health)
+        dirty_rects.extend(hud_rects)
+
+    for name, value in frame.counters.items():
+        timer.set_counter(name, value)
+    timer.set_counter('blit count', len(background) + sum(len(layer) for layer in frame.layers) + len(hud_rects))
+
+    # The backgrounds only change when the camera moves, so while it is still only the sprites drawn this frame and
+    # the places they were drawn last frame need to reach the display
+    with timer.phase('present'):
+        if DIRTY_RECTS and not camera_moved:
+            pygame.display.update(game_state.dirty_rects + dirty_rects)
+        else:
+            pygame.display.update()
+    game_state.dirty_rects = dirty_rects
 
-    for terrain in game_state.terrain:
-        terrain.draw(screen, calc_screen_position)
 
-    for enemy in game_state.enemies:
-        enemy.draw(screen, calc_screen_position)
-
-    for enemy_proj in game_state.enemy_projectiles:
-        enemy_proj.draw(screen, calc_screen_position)
-
-    player.draw(screen, calc_screen_position)
-
-    for projectile in game_state.player_projectiles:
-        projectile.draw(screen, calc_screen_position)
-
-    if DEBUG:
-        pygame.draw.polygon(screen, (0, 255, 0), rect_to_pointlist(player.hitbox, calc_screen_position), 1)
-        for enemy in game_state.enemies:
-            pygame.draw.polygon(screen, (255, 0, 0), rect_to_pointlist(enemy.hitbox, calc_screen_position), 1)
-
-    fps = game_state.hud['font'].render(f"{game_state.clock.get_fps():.2f} fps", True, (0, 255, 0))
-    screen.blit(fps, (0, 0))
-    pygame.display.update()
+def draw(screen, game_state):
+    present(screen, capture(game_state), game_state, game_state.clock.get_fps())
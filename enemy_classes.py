@@ -1,10 +1,15 @@
-from game_objects import VelocityUpdates, BlockedByTerrain, Projectile
+from game_objects import VelocityUpdates, BlockedByTerrain, Projectile, projectile_pool
 import pygame
 import random
 import math
 
 
 class AssaultSoldier(BlockedByTerrain):
+    # Longest dt moved in one go, a fall at any more can skip past the top of a floor
+    max_step = 3
+    __slots__ = ('moving_right', 'shooting_at', 'range', 'shots_in_burst', 'shots_fired', 'fire_delay',
+                 'pre_fire_delay', 'next_shot_at', 'updated_at', 'dormant', 'bullet_animation', 'crowd')
+
     def __init__(self,
                  initial_pos=None,
                  move_speed=5,
@@ -23,36 +28,33 @@ class AssaultSoldier(BlockedByTerrain):
         self.range = 400
         self.shots_in_burst = 3
         self.shots_fired = 0
-        self.fire_delay = 25
-        self.pre_fire_delay = 180
-        self.pre_fire_waited = 0
-        self.shot_cooldown = 0
+        # In game time, where 1 is 30ms: a burst's first shot comes pre_fire_delay + fire_delay after the soldier stops
+        # to aim and the others fire_delay apart
+        self.fire_delay = 14
+        self.pre_fire_delay = 100
+        self.next_shot_at = math.inf
+        # Game time of the last update, the scheduler only updates dormant soldiers every so often
+        self.updated_at = None
+        self.dormant = False
         self.bullet_animation = animations['projectile']
+        self.crowd = None
 
-    def update(self, dt, terrain, player_pos):
-        if not self.shooting_at and pygame.Vector2(self.hitbox.center).distance_to(player_pos) < self.range:
+    def update(self, dt, terrain, player_pos, sees_player, now):
+        # sees_player comes from a batched SightQueries.enemies_in_sight: idle, in range and not blocked by terrain
+        if sees_player:
             self.shooting_at = player_pos
+            self.next_shot_at = now + self.pre_fire_delay + self.fire_delay
         else:
             self.moving_right = player_pos.x > self.hitbox.center[0]
 
-        self.update_velocity(dt)
         animation = "face_right" if self.moving_right > 0 else "face_left"
         self.sprite.update(dt, animation)
-        self.update_pos(dt, terrain)
-
-        if self.shooting_at:
-            if self.shots_fired < self.shots_in_burst:
-                if self.pre_fire_waited < self.pre_fire_delay:
-                    self.pre_fire_waited += 1
-                else:
-                    if self.shot_cooldown < self.fire_delay:
-                        self.shot_cooldown += 1
-                    else:
-                        return self.shoot()
-            else:
-                self.shooting_at = None
-                self.shots_fired = 0
-                self.pre_fire_waited = 0
+        # A soldier catching up after being dormant moves in steps short enough not to pass through terrain
+        steps = math.ceil(dt / self.max_step)
+        for _ in range(steps):
+            self.update_velocity(dt / steps)
+            self.update_pos(dt / steps, terrain)
+        self.updated_at = now
 
     def update_velocity(self, dt):
         VelocityUpdates.gravity(self, dt)
@@ -63,15 +65,28 @@ class AssaultSoldier(BlockedByTerrain):
             else:
                 self.x_vel = 0
 
-    def shoot(self):
+    def fire_scheduled(self):
+        # Called by the scheduler once game time reaches next_shot_at
+        projectile = self.fire_gun(self.shooting_at)
         self.shots_fired += 1
-        self.shot_cooldown = 0
-        return Projectile(initial_vel=Projectile.calculate_proj_velocity(self.shooting_at, self.hitbox.center, 5),
-                          animations=self.bullet_animation.copy(),
-                          initial_pos=pygame.Vector2(self.hitbox.center),
-                          damage=10)
+        if self.shots_fired < self.shots_in_burst:
+            self.next_shot_at += self.fire_delay
+        else:
+            self.shooting_at = None
+            self.shots_fired = 0
+            self.next_shot_at = math.inf
+        return projectile
+
+    def fire_gun(self, target_pos):
+        return projectile_pool.get(initial_vel=Projectile.calculate_proj_velocity(target_pos, self.hitbox.center, 5),
+                                   animations=self.bullet_animation,
+                                   initial_pos=pygame.Vector2(self.hitbox.center),
+                                   damage=10)
 
     def take_damage(self, proj):
+        if self.crowd is not None:
+            self.crowd.take_damage(self, proj)
+            return
         self.health -= proj.damage
         knockback = proj.damage / 20
         self.y_vel -= knockback
@@ -3,6 +3,8 @@ import math
 
 from typing import Tuple, List
 
+from collision import sweep_rect
+
 gravity = 2.3
 
 
@@ -16,80 +18,118 @@ class VelocityUpdates:
         self.y_vel -= self.drag * self.y_vel * dt
 
 
-class Sprite:
+class Removable:
+    __slots__ = ('container', 'container_slot', '_to_remove')
+
+    def __init__(self):
+        self.container = self.container_slot = None
+        self._to_remove = False
+
+    @property
+    def to_remove(self):
+        return self._to_remove
+
+    @to_remove.setter
+    def to_remove(self, to_remove):
+        self._to_remove = to_remove
+        if to_remove and self.container is not None:
+            self.container.flag(self)
+
+
+class Sprite(Removable):
+    # _x and _y are the only record of position. The hitbox follows them, rounded, and is where the image is drawn
+    __slots__ = ('animations', 'animation', 'animation_time', 'sprite_num', 'hitbox',
+                 '_x', '_y', '_previous_x', '_previous_y')
+
     def __init__(self,
                  animations,
                  initial_pos=pygame.Vector2(0, 0),
                  initial_animation='neutral'):
+        super().__init__()
         self.animations = animations
         self.animation = self.animations[initial_animation]
-        self.image_pos: pygame.Vector2 = initial_pos
-        if self.animation.hitbox_size:
-            self.hitbox = pygame.Rect(self.image_pos, self.animation.hitbox_size)
-        self._exact_pos: List[float, float] = [initial_pos.x, initial_pos.y]
-        self.to_remove: bool = False
+        self.animation_time = 0
+        self.sprite_num = 0
+        self.hitbox = pygame.Rect(initial_pos, self.animation.hitbox_size or (0, 0))
+        self._x = self._previous_x = initial_pos[0]
+        self._y = self._previous_y = initial_pos[1]
 
     def update(self, dt, animation_name=None):
         if not animation_name or (self.animation and self.animation.name is animation_name):
-            self.animation.next_frame()
+            self.animation_time, self.sprite_num = self.animation.advance(self.animation_time, self.sprite_num, dt)
         else:
-            self.animation.reset()
+            self.animation_time = self.sprite_num = 0
             self.animation = self.animations[animation_name]
-            self.hitbox = pygame.Rect(self.image_pos, self.animation.hitbox_size)
+            # Resized in place so that anything holding on to the hitbox keeps seeing the current one
+            self.hitbox.size = self.animation.hitbox_size
+
+    def get_sprite(self, alpha=1):
+        frame, offset = self.animation.frames[self.sprite_num], self.animation.offsets[self.sprite_num]
+        if alpha == 1:
+            return frame, pygame.Vector2(self.hitbox.left + offset[0], self.hitbox.top + offset[1])
+        x, y = self.interpolated_pos(alpha)
+        return frame, pygame.Vector2(round(x) + offset[0], round(y) + offset[1])
 
-    def get_sprite(self):
-        return self.animation.get_current_sprite(), self.image_pos + self.animation.image_offset
+    def interpolated_pos(self, alpha):
+        previous_x, previous_y = self._previous_x, self._previous_y
+        return previous_x + (self._x - previous_x) * alpha, previous_y + (self._y - previous_y) * alpha
+
+    def store_previous_pos(self):
+        self._previous_x = self._x
+        self._previous_y = self._y
 
     @property
     def x(self):
-        return self._exact_pos[0]
+        return self._x
 
     @x.setter
     def x(self, x):
-        self._exact_pos[0] = x
-        self.hitbox.left = self.image_pos.x = round(x)
+        self._x = x
+        self.hitbox.left = round(x)
 
     @property
     def y(self):
-        return self._exact_pos[1]
+        return self._y
 
     @y.setter
     def y(self, y):
-        self._exact_pos[1] = y
-        self.hitbox.top = self.image_pos.y = round(y)
+        self._y = y
+        self.hitbox.top = round(y)
+
 
+class SingleSprite(Removable):
+    # hitbox is the sprite's own Rect, held directly to save a lookup on every collision test
+    __slots__ = ('sprite', 'hitbox')
 
-class SingleSprite:
     def __init__(self,
                  animations,
                  initial_pos,
                  initial_animation='neutral'):
+        super().__init__()
         self.sprite = Sprite(animations=animations,
                              initial_pos=initial_pos,
                              initial_animation=initial_animation)
-        self.to_remove = False
+        self.hitbox = self.sprite.hitbox
 
-    def hit_by(self, proj):
-        return proj.hitbox.colliderect(self.sprite.hitbox)
+    def blit_args(self, coordinate_map, alpha=1):
+        image, pos = self.sprite.get_sprite(alpha)
+        return image, coordinate_map(pos)
 
-    def draw(self, surface, coordinate_map):
-        image, pos = self.sprite.get_sprite()
-        surface.blit(image, coordinate_map(pos))
+    def draw(self, surface, coordinate_map, alpha=1):
+        surface.blit(*self.blit_args(coordinate_map, alpha))
 
     @property
     def x(self):
-        return self.sprite.x
+        return self.sprite._x
 
     @property
     def y(self):
-        return self.sprite.y
-
-    @property
-    def hitbox(self):
-        return self.sprite.hitbox
+        return self.sprite._y
 
 
 class BlockedByTerrain(SingleSprite):
+    __slots__ = ('force_dropping', 'x_vel', 'y_vel', 'in_air', 'drag', 'move_speed', 'health')
+
     def __init__(self, animations, initial_pos, initial_animation):
         super().__init__(animations, initial_pos, initial_animation)
         self.force_dropping = False
@@ -103,7 +143,7 @@ class BlockedByTerrain(SingleSprite):
         moved_hb.y = new_y
 
         all_x_ok = all_y_ok = all_in_air = True
-        for t in terrain:
+        for t in terrain.query(hitbox.union(moved_hb).inflate(2, 2)):
             x_ok, y_ok, in_air = t.block_object(self, moved_hb)
             all_x_ok = all_x_ok and x_ok
             all_y_ok = all_y_ok and y_ok
@@ -130,6 +170,8 @@ class Controls:
 
 
 class Player(BlockedByTerrain):
+    __slots__ = ('jetpack_power', 'shoot_delay', 'till_next_shot')
+
     def __init__(self,
                  initial_pos=(0, 0),
                  initial_vel=(0, 0),
@@ -192,17 +234,18 @@ class Player(BlockedByTerrain):
             return self.fire_gun(target_pos, pygame.Vector2(self.sprite.x + 32, self.sprite.y + 34))
 
     def fire_gun(self, target_pos, start_pos):
-        return Projectile(initial_vel=Projectile.calculate_proj_velocity(target_pos, start_pos, 40),
-                          animations=self.sprite.animations['bullet'],
-                          initial_pos=start_pos,
-                          damage=100)
+        return projectile_pool.get(initial_vel=Projectile.calculate_proj_velocity(target_pos, start_pos, 40),
+                                   animations=self.sprite.animations['bullet'],
+                                   initial_pos=start_pos,
+                                   damage=100)
 
     def take_damage(self, proj):
         self.health -= proj.damage
-        print(self.health)
 
 
 class Projectile(Sprite):
+    __slots__ = ('x_vel', 'y_vel', 'damage')
+
     def __init__(self,
                  animations,
                  initial_pos,
@@ -213,20 +256,47 @@ class Projectile(Sprite):
         self.y_vel = initial_vel.y
         self.damage = damage
 
-    def update(self, dt, *targets):
+    def update(self, dt, *broadphases):
         super().update(dt)
+        hitbox = self.hitbox
+        start_x, start_y, left, top = self._x, self._y, hitbox.left, hitbox.top
         self.x += self.x_vel * dt
         self.y += self.y_vel * dt
 
-        for target in targets:
-            if target.hit_by(self):
-                target.take_damage(self)
-                self.to_remove = True
-                break
+        # Test the whole path rather than where the projectile ends up, so it can't pass through anything thinner
+        # than one step. The earliest hit across every broadphase wins
+        dx, dy = hitbox.left - left, hitbox.top - top
+        swept = hitbox.union((left, top, hitbox.width, hitbox.height))
+        hit, hit_time = None, 1
+        for broadphase in broadphases:
+            for target in broadphase.query(swept):
+                t = sweep_rect(left, top, hitbox.width, hitbox.height, dx, dy, target.hitbox)
+                if t is not None and t < hit_time:
+                    hit, hit_time = target, t
+        if hit is not None:
+            self.x = start_x + (self._x - start_x) * hit_time
+            self.y = start_y + (self._y - start_y) * hit_time
+            hit.take_damage(self)
+            self.to_remove = True
+
+    def reset(self, animations, initial_pos, initial_vel, damage):
+        self.animations = animations
+        self.animation = animations['neutral']
+        self.animation_time = self.sprite_num = 0
+        self.hitbox.update(initial_pos, self.animation.hitbox_size)
+        self._x = self._previous_x = initial_pos.x
+        self._y = self._previous_y = initial_pos.y
+        self.to_remove = False
+        self.x_vel = initial_vel.x
+        self.y_vel = initial_vel.y
+        self.damage = damage
 
-    def draw(self, surface, coordinate_map):
-        image, pos = self.get_sprite()
-        surface.blit(image, coordinate_map(pos))
+    def blit_args(self, coordinate_map, alpha=1):
+        image, pos = self.get_sprite(alpha)
+        return image, coordinate_map(pos)
+
+    def draw(self, surface, coordinate_map, alpha=1):
+        surface.blit(*self.blit_args(coordinate_map, alpha))
 
     @staticmethod
     def calculate_proj_velocity(target_pos, start_pos, proj_speed):
@@ -237,16 +307,103 @@ class Projectile(Sprite):
         return pygame.Vector2(x_vel, y_vel)
 
 
+class ProjectilePool:
+    def __init__(self):
+        self._free: List[Projectile] = []
+        self.created = 0
+        self.reused = 0
+        self.released = 0
+
+    def get(self, animations, initial_pos, initial_vel, damage):
+        if self._free:
+            self.reused += 1
+            proj = self._free.pop()
+            proj.reset(animations, initial_pos, initial_vel, damage)
+            return proj
+        self.created += 1
+        return Projectile(animations, initial_pos, initial_vel, damage)
+
+    def release(self, projectiles):
+        before = len(self._free)
+        self._free.extend(projectiles)
+        self.released += len(self._free) - before
+
+    @property
+    def free(self):
+        return len(self._free)
+
+
+projectile_pool = ProjectilePool()
+
+
 class Background(Sprite):
+    __slots__ = ('z', 'pos')
+
     def __init__(self, animations, initial_pos, z, initial_animation='neutral'):
         super().__init__(animations, initial_pos=initial_pos, initial_animation=initial_animation)
         self.z: float = z
         self.pos: Tuple[float, float] = initial_pos
 
-    def draw(self, screen: pygame.Surface, camera_aim: pygame.Vector2):
+    def blit_args(self, camera_aim: pygame.Vector2):
         if self.z:
             pos_this_frame = self.pos[0] - camera_aim.x / self.z, self.pos[1] - camera_aim.y / self.z
         else:
             pos_this_frame = self.pos
 
-        screen.blit(self.get_sprite()[0], pos_this_frame)
+        return self.get_sprite()[0], pos_this_frame
+
+    def draw(self, screen: pygame.Surface, camera_aim: pygame.Vector2):
+        screen.blit(*self.blit_args(camera_aim))
+
+
+class ParallaxBackground:
+    tile_size = 256
+
+    def __init__(self, layers, fill_colour=(123, 123, 123)):
+        self.fill_colour = fill_colour
+        self.static_layer = layers.get(0, [])
+        self.scrolling_layers = [(z, layers[z]) for z in sorted(layers.keys(), reverse=True) if z > 0 and layers[z]]
+        self._bounds = {}
+        for z, backgrounds in self.scrolling_layers:
+            rects = [pygame.Rect(bg.pos, bg.get_sprite()[0].get_size()) for bg in backgrounds]
+            self._bounds[z] = rects[0].unionall(rects[1:])
+        self._view_size = None
+        self._base = None
+        self._strips = {}
+        self._premultiplied = {}
+
+    def blit_args(self, camera_aim: pygame.Vector2, view_size: Tuple[int, int]):
+        if view_size != self._view_size:
+            self._view_size = view_size
+            self._base = pygame.Surface(view_size)
+            self._base.fill(self.fill_colour)
+            self._base.blits([bg.blit_args(camera_aim) for bg in self.static_layer], doreturn=False)
+            self._strips.clear()
+
+        args = [(self._base, (0, 0))]
+        for z, backgrounds in self.scrolling_layers:
+            scroll_x, scroll_y = camera_aim.x / z, camera_aim.y / z
+            origin, area, strip = self._strips.get(z, (None, None, None))
+            if origin is None \
+                    or not 0 <= scroll_x - origin[0] < self.tile_size \
+                    or not 0 <= scroll_y - origin[1] < self.tile_size:
+                origin = (scroll_x // self.tile_size * self.tile_size, scroll_y // self.tile_size * self.tile_size)
+                tile = pygame.Rect(origin, (view_size[0] + self.tile_size, view_size[1] + self.tile_size))
+                area = tile.clip(self._bounds[z])
+                strip = self._render_strip(backgrounds, area) if area else None
+                self._strips[z] = origin, area, strip
+            if strip:
+                args.append((strip, (area.x - scroll_x, area.y - scroll_y), None, pygame.BLEND_PREMULTIPLIED))
+        return args
+
+    def _render_strip(self, backgrounds, area):
+        # Compositing premultiplied images keeps partially transparent pixels exact once the strip is blitted
+        strip = pygame.Surface(area.size, pygame.SRCALPHA)
+        for bg in backgrounds:
+            image = bg.get_sprite()[0]
+            if image not in self._premultiplied:
+                self._premultiplied[image] = image.premul_alpha()
+            strip.blit(self._premultiplied[image],
+                       (bg.pos[0] - area.x, bg.pos[1] - area.y),
+                       special_flags=pygame.BLEND_PREMULTIPLIED)
+        return strip
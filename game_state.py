@@ -1,3 +1,73 @@
+from collision import SpatialHash
+from crowds import SightQueries
+from game_objects import ParallaxBackground, projectile_pool
+from profiling import PhaseTimer
+from scheduling import EnemyScheduler
+
+
+class EntityList:
+    def __init__(self, entities=()):
+        self._entities = []
+        self._flagged = []
+        self.extend(entities)
+
+    def append(self, entity):
+        entity.container = self
+        entity.container_slot = len(self._entities)
+        self._entities.append(entity)
+        if entity.to_remove:
+            self._flagged.append(entity)
+
+    def extend(self, entities):
+        for entity in entities:
+            self.append(entity)
+
+    def replace(self, entities):
+        # Refills the list in place, so anything holding on to it sees the new contents
+        for entity in self._entities:
+            if entity.container is self:
+                entity.container = entity.container_slot = None
+        self._entities[:] = entities
+        for slot, entity in enumerate(self._entities):
+            entity.container = self
+            entity.container_slot = slot
+        self._flagged[:] = [entity for entity in self._entities if entity.to_remove]
+
+    def flag(self, entity):
+        self._flagged.append(entity)
+
+    def flagged_slots(self):
+        # In the order they were flagged, which decides where remove_flagged moves the survivors
+        return [entity.container_slot for entity in self._flagged if entity.container is self and entity.to_remove]
+
+    def remove_flagged(self):
+        if not self._flagged:
+            return []
+        entities = self._entities
+        removed = []
+        for entity in self._flagged:
+            if entity.container is not self or not entity.to_remove:
+                continue
+            # Swap-remove: the last entity fills the hole, so only it changes position in the draw order
+            last = entities.pop()
+            if last is not entity:
+                entities[entity.container_slot] = last
+                last.container_slot = entity.container_slot
+            entity.container = entity.container_slot = None
+            removed.append(entity)
+        self._flagged.clear()
+        return removed
+
+    def __iter__(self):
+        return iter(self._entities)
+
+    def __len__(self):
+        return len(self._entities)
+
+    def __getitem__(self, index):
+        return self._entities[index]
+
+
 class GameState:
     def __init__(self,
                  player,
@@ -11,22 +81,55 @@ class GameState:
                  last_camera_center=None):
         self.player = player
         self.clock = clock
-        self.enemies = enemies or []
-        self.player_projectiles = player_projectiles or []
-        self.enemy_projectiles = enemy_projectiles or []
+        self.enemies = EntityList(enemies or [])
+        self.player_projectiles = EntityList(player_projectiles or [])
+        self.enemy_projectiles = EntityList(enemy_projectiles or [])
         self.background_layers = background_layers or {}
+        self.background = ParallaxBackground(self.background_layers)
         self.terrain = terrain or []
-        self.hud = hud or {}
+        self.terrain_index = SpatialHash(self.terrain)
+        self.enemy_index = None
+        self.hud = hud
+        self.enemy_crowd = None
+        self.enemy_scheduler = EnemyScheduler(self.enemies)
+        self.sight_queries = SightQueries()
         self.last_camera_center = last_camera_center
+        self.presented_camera_center = None
+        self.dirty_rects = []
         self.in_cutscene = True
         self.timer = 0
         self.cutscene_timer = 0
+        self.accumulator = 0
+        self.interpolation_alpha = 1
+        self.phase_timer = PhaseTimer()
+        self.show_profiler = False
+
+    def set_terrain(self, terrain):
+        self.terrain = terrain
+        self.terrain_index = SpatialHash(terrain)
+
+    def enemies_changed(self):
+        # The crowd and the scheduler only know about the soldiers they were loaded with, so reload them with the
+        # current ones
+        if self.enemy_crowd is not None:
+            self.enemy_crowd.write_back()
+            self.enemy_crowd.load(e for e in self.enemies if not e.to_remove)
+        else:
+            self.enemy_scheduler.load(e for e in self.enemies if not e.to_remove)
 
     def remove_to_remove_objects(self):
-        for l in [self.player_projectiles,
-                  self.enemy_projectiles,
-                  self.enemies]:
-            l[:] = [e for e in l if not e.to_remove]
+        projectile_pool.release(self.player_projectiles.remove_flagged())
+        projectile_pool.release(self.enemy_projectiles.remove_flagged())
+        self.enemies.remove_flagged()
+
+    def store_previous_positions(self):
+        self.player.sprite.store_previous_pos()
+        for enemy in self.enemies:
+            enemy.sprite.store_previous_pos()
+        for proj in self.player_projectiles:
+            proj.store_previous_pos()
+        for proj in self.enemy_projectiles:
+            proj.store_previous_pos()
 
     def increment_timers(self, dt):
         self.timer += dt
@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+import valkyrie
+from asset_factory import AssetFactory, animation_frames, surface_bytes
+from enemy_classes import AssaultSoldier
+from game_objects import Controls
+from levels import Level
+from valkyrie import Inputs
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PHASES = ['level', 'removal', 'player', 'enemies', 'projectiles']
+
+
+class PressedKeys:
+    def __init__(self, keys=()):
+        self.keys = frozenset(keys)
+
+    def __getitem__(self, key):
+        return key in self.keys
+
+
+def idle_script(tick):
+    return Inputs(PressedKeys(), False, (0, 0))
+
+
+def patrol_script(tick):
+    # Short hops back and forth keep the player inside level one's walls, so the chunks around the spawned soldiers
+    # stay loaded. Flying any higher clears the walls and streaming stashes every soldier left behind
+    heading_right = (tick // 90) % 2 == 0
+    keys = [Controls.up if tick % 60 < 10 else Controls.down,
+            Controls.right if heading_right else Controls.left]
+    aim = (valkyrie.SCREEN_WIDTH, valkyrie.SCREEN_HEIGHT // 2) if heading_right else (0, valkyrie.SCREEN_HEIGHT // 2)
+    return Inputs(PressedKeys(keys), True, aim)
+
+
+SCRIPTS = {
+    'idle': idle_script,
+    'patrol': patrol_script,
+}
+
+
+def load_inputs(path):
+    with open(path) as f:
+        frames = json.load(f)
+    if isinstance(frames, dict):
+        # A replay.Recorder session, whose frames also start with their dt
+        frames = [frame[1:] for frame in frames['frames']]
+    recorded = [Inputs(PressedKeys(keys), mouse_pressed, tuple(mouse_pos)) for keys, mouse_pressed, mouse_pos in frames]
+
+    def recorded_script(tick):
+        return recorded[min(tick, len(recorded) - 1)]
+    return recorded_script
+
+
+def spawn_soldiers(state, assets, count, rng):
+    for _ in range(count):
+        state.enemies.append(AssaultSoldier(initial_pos=pygame.Vector2(rng.uniform(-150, 650), 400),
+                                            move_speed=rng.randint(3, 6),
+                                            animations=assets.assault_soldier_green()))
+    state.enemies_changed()
+
+
+def attach_crowd(state, vectorized=False, workers=0):
+    if workers:
+        from parallel_crowds import ParallelAssaultSoldierCrowd
+        state.enemy_crowd = ParallelAssaultSoldierCrowd(state.enemies, workers=workers)
+    elif vectorized:
+        from crowds import AssaultSoldierCrowd
+        state.enemy_crowd = AssaultSoldierCrowd(state.enemies)
+
+
+def run(ticks=1000, enemies=0, script=patrol_script, dt=1, vectorized=False, trace_memory=False, seed=0, workers=0):
+    pygame.init()
+    pygame.display.set_mode((valkyrie.SCREEN_WIDTH, valkyrie.SCREEN_HEIGHT))
+    if trace_memory:
+        tracemalloc.start()
+
+    random.seed(seed)
+    assets = AssetFactory(raw_cache=valkyrie.RAW_ASSET_CACHE)
+    level = Level.load(Level.ONE, assets)
+    state = level.initial_game_state
+    state.in_cutscene = False
+    spawn_soldiers(state, assets, enemies, random.Random(seed))
+    attach_crowd(state, vectorized, workers)
+    requested_enemies = len(state.enemies)
+
+    start = timeit.default_timer()
+    for tick in range(ticks):
+        state.last_camera_center = pygame.Vector2(state.player.x, state.player.y)
+        valkyrie.simulate(state, level.update, dt, script(tick))
+    elapsed = timeit.default_timer() - start
+
+    report = {
+        'ticks': ticks,
+        'seconds': elapsed,
+        'ticks_per_second': ticks / elapsed,
+        'phase_ms': {phase: state.phase_timer.mean_ms(phase) for phase in PHASES},
+        # Soldiers that end up outside the loaded chunks are stashed and no longer simulated, so a final count well
+        # below the requested one means the run measured a mostly empty world
+        'requested_enemies': requested_enemies,
+        'enemies': len(state.enemies),
+        'player_projectiles': len(state.player_projectiles),
+        'enemy_projectiles': len(state.enemy_projectiles),
+        'asset_bytes': sum(assets.memory_report().values()),
+        'enemy_sprite_bytes': surface_bytes(frame for enemy in state.enemies
+                                            for frame in animation_frames(enemy.sprite.animations)),
+        'transform_cache': assets.transformed_sprite.cache_info()._asdict(),
+    }
+    if workers:
+        state.enemy_crowd.close()
+    if trace_memory:
+        report['traced_bytes'], report['peak_traced_bytes'] = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    if resource:
+        # ru_maxrss is in kilobytes on Linux
+        report['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    pygame.quit()
+    return report
+
+
+def print_report(report):
+    print(f"{report['ticks']} ticks in {report['seconds']:.2f}s: {report['ticks_per_second']:.1f} ticks/s")
+    for phase, ms in report['phase_ms'].items():
+        print(f"  {phase:<12} {ms:8.3f} ms/tick")
+    print(f"  entities: {report['enemies']} of {report['requested_enemies']} enemies, "
+          f"{report['player_projectiles']} player projectiles, "
+          f"{report['enemy_projectiles']} enemy projectiles")
+    print(f"  sprite memory: {report['asset_bytes'] / 2 ** 20:.2f} MiB of assets, "
+          f"{report['enemy_sprite_bytes'] / 2 ** 20:.2f} MiB referenced by enemies")
+    print(f"  transform cache: {report['transform_cache']['hits']} hits, {report['transform_cache']['misses']} misses")
+    if 'peak_traced_bytes' in report:
+        print(f"  traced memory: {report['traced_bytes'] / 2 ** 20:.1f} MiB, "
+              f"peak {report['peak_traced_bytes'] / 2 ** 20:.1f} MiB")
+    if 'max_rss_bytes' in report:
+        print(f"  max rss: {report['max_rss_bytes'] / 2 ** 20:.1f} MiB")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run the simulation without a display and report throughput")
+    parser.add_argument('--ticks', type=int, default=1000)
+    parser.add_argument('--enemies', type=int, default=0, help="extra soldiers to spawn on top of the level's own")
+    parser.add_argument('--script', choices=SCRIPTS, default='patrol')
+    parser.add_argument('--inputs', help="JSON file of recorded [keys, mouse_pressed, mouse_pos] per tick")
+    parser.add_argument('--dt', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--vectorized', action='store_true', help="simulate soldiers with AssaultSoldierCrowd")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="simulate soldiers with ParallelAssaultSoldierCrowd across this many processes")
+    parser.add_argument('--trace-memory', action='store_true', help="track Python allocations with tracemalloc")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = run(ticks=args.ticks,
+                 enemies=args.enemies,
+                 script=load_inputs(args.inputs) if args.inputs else SCRIPTS[args.script],
+                 dt=args.dt,
+                 vectorized=args.vectorized,
+                 trace_memory=args.trace_memory,
+                 seed=args.seed,
+                 workers=args.workers)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,31 @@
+from typing import Dict, Tuple
+
+import pygame
+
+
+# Renders HUD text through a cache of surfaces keyed by content, so a string is only rasterized the first time it is
+# shown. Values that change every frame (fps, timings) go through throttled, which holds each one for refresh_interval
+# milliseconds so they are re-rendered at most that often rather than at the frame rate.
+class Hud:
+    max_cached_surfaces = 256
+
+    def __init__(self, font, colour=(0, 255, 0), refresh_interval=250):
+        self.font = font
+        self.colour = colour
+        self.refresh_interval = refresh_interval
+        self._surfaces: Dict[str, pygame.Surface] = {}
+        self._shown: Dict[str, Tuple[str, int]] = {}
+
+    def render(self, text):
+        surface = self._surfaces.get(text)
+        if surface is None:
+            if len(self._surfaces) >= self.max_cached_surfaces:
+                self._surfaces.clear()
+            surface = self._surfaces[text] = self.font.render(text, True, self.colour)
+        return surface
+
+    def throttled(self, key, text, now):
+        shown = self._shown.get(key)
+        if shown is None or now - shown[1] >= self.refresh_interval:
+            shown = self._shown[key] = (text, now)
+        return self.render(shown[0])
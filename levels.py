@@ -1,3 +1,5 @@
+import json
+import os
 import random
 from enum import Enum
 from collections import defaultdict
@@ -7,47 +9,213 @@ import pygame
 import enemy_classes
 from game_objects import Player, Background
 from game_state import GameState
+from hud import Hud
 from terrain import Terrain
 
+_level_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)), "level_data")
+
+
+def _chunk_of(pos, chunk_size):
+    return int(pos[0] // chunk_size), int(pos[1] // chunk_size)
+
+
+def _chunk_path(level_path, chunk):
+    return os.path.join(level_path, "chunks", f"{chunk[0]}_{chunk[1]}.json")
+
+
+def write_level(level_path, chunk_size, player_pos, backgrounds, terrain, enemies):
+    # Terrain pieces are written into every chunk they overlap, and stay loaded while any of those chunks are
+    chunks = defaultdict(lambda: {'terrain': [], 'enemies': []})
+    for piece_id, piece in enumerate(terrain):
+        rect = pygame.Rect(piece['pos'], piece['size'])
+        for cx in range(rect.left // chunk_size, (rect.right - 1) // chunk_size + 1):
+            for cy in range(rect.top // chunk_size, (rect.bottom - 1) // chunk_size + 1):
+                chunks[cx, cy]['terrain'].append({'id': piece_id, **piece})
+    for enemy in enemies:
+        chunks[_chunk_of(enemy['pos'], chunk_size)]['enemies'].append(enemy)
+
+    os.makedirs(os.path.join(level_path, "chunks"), exist_ok=True)
+    with open(os.path.join(level_path, "level.json"), 'w') as f:
+        json.dump({'chunk_size': chunk_size, 'player': player_pos, 'backgrounds': backgrounds}, f, indent=2)
+    for chunk, contents in chunks.items():
+        with open(_chunk_path(level_path, chunk), 'w') as f:
+            json.dump(contents, f, separators=(',', ':'))
+
+
+class StreamedLevel:
+    level_path = None
+    # The asset_factory sprite groups the level draws, and the level that follows it
+    sprite_groups = ('player', 'soldiers', 'terrain', 'backgrounds')
+    next_level = None
+    # In chunks, measured from the chunk the player is in
+    load_distance = 1
+    unload_distance = 2
 
-class LevelOne:
     def __init__(self, asset_factory):
         self.asset_factory = asset_factory
+        # Decoding starts now, each group waits to be converted until the level first asks for one of its sprites
+        asset_factory.preload_groups(self.sprite_groups)
+        with open(os.path.join(self.level_path, "level.json")) as f:
+            self.header = json.load(f)
+        self.chunk_size = self.header['chunk_size']
+        self._reset_streaming()
+
+    def _reset_streaming(self):
+        self.loaded_chunks = set()
+        self._player_chunk = None
+        self._visited_chunks = set()
+        self._stashed_enemies = defaultdict(list)
+        self._chunk_terrain = {}
+        self._terrain = {}
+        self._terrain_refs = defaultdict(int)
+
+    def streaming_state(self):
+        # Shallow copies for snapshots.Snapshot: the terrain pieces are shared, only the bookkeeping is copied
+        return (set(self.loaded_chunks), self._player_chunk, set(self._visited_chunks),
+                {chunk: list(stash) for chunk, stash in self._stashed_enemies.items()},
+                dict(self._chunk_terrain), dict(self._terrain), dict(self._terrain_refs))
+
+    def restore_streaming_state(self, state):
+        loaded_chunks, self._player_chunk, visited_chunks, stashed_enemies, chunk_terrain, terrain, terrain_refs = state
+        self.loaded_chunks = set(loaded_chunks)
+        self._visited_chunks = set(visited_chunks)
+        self._stashed_enemies = defaultdict(list, {chunk: list(stash) for chunk, stash in stashed_enemies.items()})
+        self._chunk_terrain = dict(chunk_terrain)
+        self._terrain = dict(terrain)
+        self._terrain_refs = defaultdict(int, terrain_refs)
 
     def update(self, dt, game_state):
         game_state.increment_timers(dt)
+        if game_state.in_cutscene and self.next_level is not None:
+            # Decodes the next level's sprites on the loader threads while the cutscene plays, so they are ready by
+            # the time it loads
+            self.asset_factory.preload_groups(self.next_level.sprite_groups)
+        self.stream_chunks(game_state)
 
     @property
     def initial_game_state(self):
+        self._reset_streaming()
         assets = self.asset_factory
-        terrain = [
-                   Terrain(initial_pos=pygame.Vector2(-200, 800), animations=assets.wall_animation(900, 100)),
-                   Terrain(initial_pos=pygame.Vector2(-200, 0), animations=assets.wall_animation(20, 800)),
-                   Terrain(initial_pos=pygame.Vector2(700, 0), animations=assets.wall_animation(50, 900)),
-                   Terrain(initial_pos=pygame.Vector2(300, 300), animations=assets.wall_animation(50, 50)),
-                   Terrain(initial_pos=pygame.Vector2(200, 500), animations=assets.platform_animation(300, 8), platform=True),
-                   Terrain(initial_pos=pygame.Vector2(200, 600), animations=assets.platform_animation(300, 8), platform=True)]
         background_layers = defaultdict(list)
-        fence_width = 373
-        for bg in [Background(assets.background(), pygame.Vector2(0, 0), 0),
-                   Background(assets.foothills(), pygame.Vector2(-50, 50), 15),
-                   Background(assets.mountains(), pygame.Vector2(-50, 50), 30),
-                   Background(assets.chain_fence(), pygame.Vector2(400, 1090), 1),
-                   Background(assets.chain_fence(), pygame.Vector2(400 + fence_width, 1090), 1)]:
-            background_layers[bg.z].append(bg)
+        for bg in self.header['backgrounds']:
+            background_layers[bg['z']].append(
+                Background(getattr(assets, bg['asset'])(), pygame.Vector2(bg['pos']), bg['z']))
         state = GameState(
-            player=Player(animations=assets.player_animations(), initial_pos=pygame.Vector2(320, 550)),
-            enemies=[*[enemy_classes.AssaultSoldier(initial_pos=pygame.Vector2(50 + x, 400),
-                                                    move_speed=random.randint(3, 6),
-                                                    animations=assets.assault_soldier_green())
-                       for x in range(50, 600, 25)]],
-            terrain=terrain,
+            player=Player(animations=assets.player_animations(), initial_pos=pygame.Vector2(self.header['player'])),
             background_layers=background_layers,
             clock=pygame.time.Clock(),
-            hud={'font': pygame.font.Font(None, 20)}
+            hud=Hud(pygame.font.Font(None, 20))
         )
+        self.stream_chunks(state)
         return state
 
+    def stream_chunks(self, game_state):
+        player_chunk = _chunk_of(game_state.player.hitbox.center, self.chunk_size)
+        if player_chunk == self._player_chunk:
+            return
+        self._player_chunk = px, py = player_chunk
+
+        def within(chunk, distance):
+            return abs(chunk[0] - px) <= distance and abs(chunk[1] - py) <= distance
+
+        to_unload = [c for c in self.loaded_chunks if not within(c, self.unload_distance)]
+        to_load = [(cx, cy) for cx in range(px - self.load_distance, px + self.load_distance + 1)
+                   for cy in range(py - self.load_distance, py + self.load_distance + 1)
+                   if (cx, cy) not in self.loaded_chunks]
+        if not to_unload and not to_load:
+            return
+        if game_state.enemy_crowd is not None:
+            # Stashed soldiers keep the state the crowd holds for them
+            game_state.enemy_crowd.write_back()
+        for chunk in sorted(to_unload):
+            self._unload_chunk(game_state, chunk)
+        for chunk in to_load:
+            self._load_chunk(game_state, chunk)
+        self._stash_strays(game_state)
+        # Terrain keeps the level file's order, so collisions resolve the same however the chunks were loaded
+        game_state.set_terrain([piece for _, piece in sorted(self._terrain.items())])
+        game_state.enemies_changed()
+
+    def _load_chunk(self, game_state, chunk):
+        path = _chunk_path(self.level_path, chunk)
+        contents = {'terrain': [], 'enemies': []}
+        if os.path.exists(path):
+            with open(path) as f:
+                contents = json.load(f)
+
+        for piece in contents['terrain']:
+            if piece['id'] not in self._terrain:
+                self._terrain[piece['id']] = self._create_terrain(piece)
+            self._terrain_refs[piece['id']] += 1
+        self._chunk_terrain[chunk] = [piece['id'] for piece in contents['terrain']]
+
+        # Enemies only come from the file the first time a chunk loads, after that it gets back the ones that were in
+        # it when it unloaded. Soldiers that wandered into it while it was unloaded are waiting in its stash either way
+        spawns = self._stashed_enemies.pop(chunk, [])
+        if chunk not in self._visited_chunks:
+            spawns = contents['enemies'] + spawns
+            self._visited_chunks.add(chunk)
+        game_state.enemies.extend(self._create_enemy(spawn, game_state.timer) for spawn in spawns)
+        self.loaded_chunks.add(chunk)
+
+    def _unload_chunk(self, game_state, chunk):
+        for piece_id in self._chunk_terrain.pop(chunk):
+            self._terrain_refs[piece_id] -= 1
+            if not self._terrain_refs[piece_id]:
+                del self._terrain[piece_id], self._terrain_refs[piece_id]
+
+        for enemy in game_state.enemies:
+            if not enemy.to_remove and _chunk_of(enemy.hitbox.center, self.chunk_size) == chunk:
+                self._stash_enemy(chunk, enemy, game_state.timer)
+        self.loaded_chunks.discard(chunk)
+
+    def _stash_strays(self, game_state):
+        # Soldiers that walked or fell out of the loaded chunks have no terrain left around them, so they wait in the
+        # stash of the chunk they are in until it loads
+        for enemy in game_state.enemies:
+            chunk = _chunk_of(enemy.hitbox.center, self.chunk_size)
+            if not enemy.to_remove and chunk not in self.loaded_chunks:
+                self._stash_enemy(chunk, enemy, game_state.timer)
+
+    def _stash_enemy(self, chunk, enemy, now):
+        # Everything that changes about a soldier, so it comes back as it left. Game times are kept relative to when
+        # it was stashed, the soldier is paused until its chunk loads again
+        target = enemy.shooting_at
+        self._stashed_enemies[chunk].append({
+            'type': 'assault_soldier', 'pos': [enemy.x, enemy.y], 'move_speed': enemy.move_speed,
+            'health': enemy.health, 'velocity': [enemy.x_vel, enemy.y_vel], 'in_air': enemy.in_air,
+            'moving_right': enemy.moving_right, 'shooting_at': None if target is None else [target.x, target.y],
+            'shots_fired': enemy.shots_fired, 'next_shot_in': enemy.next_shot_at - now})
+        enemy.to_remove = True
+
+    def _create_terrain(self, piece):
+        width, height = piece['size']
+        if piece['type'] == 'platform':
+            return Terrain(initial_pos=pygame.Vector2(piece['pos']),
+                           animations=self.asset_factory.platform_animation(width, height),
+                           platform=True)
+        return Terrain(initial_pos=pygame.Vector2(piece['pos']),
+                       animations=self.asset_factory.wall_animation(width, height))
+
+    def _create_enemy(self, spawn, now):
+        move_speed = spawn['move_speed'] if 'move_speed' in spawn else random.randint(3, 6)
+        enemy = enemy_classes.AssaultSoldier(initial_pos=pygame.Vector2(spawn['pos']),
+                                             move_speed=move_speed,
+                                             animations=self.asset_factory.assault_soldier_green())
+        if 'health' in spawn:
+            enemy.health = spawn['health']
+            enemy.x_vel, enemy.y_vel = spawn['velocity']
+            enemy.in_air = spawn['in_air']
+            enemy.moving_right = spawn['moving_right']
+            enemy.shooting_at = None if spawn['shooting_at'] is None else pygame.Vector2(spawn['shooting_at'])
+            enemy.shots_fired = spawn['shots_fired']
+            enemy.next_shot_at = now + spawn['next_shot_in']
+        return enemy
+
+
+class LevelOne(StreamedLevel):
+    level_path = os.path.join(_level_folder, "one")
+
 
 class Level(Enum):
     ONE = LevelOne
@@ -0,0 +1,165 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from crowds import AssaultSoldierCrowd, SoldierArrays, _TerrainGrid
+
+# Besides what the main process needs every tick, the workers mirror the rest of the soldiers' state here, so it can
+# be read (for snapshots) without asking them for it
+_STATE = ['x', 'y', 'moving_right', 'target_x', 'target_y', 'x_vel', 'y_vel', 'in_air', 'force_dropping', 'shooting',
+          'shots_fired', 'next_shot_at', 'updated_at', 'dormant', 'hb_left', 'hb_top', 'hb_width', 'hb_height']
+_OUTPUTS = ['fires', 'due', 'dt'] + _STATE
+_COLUMN = {name: i for i, name in enumerate(_OUTPUTS)}
+
+
+def _output_rows(memory, capacity):
+    return np.frombuffer(memory, dtype=float).reshape(capacity, len(_OUTPUTS))
+
+
+def _worker_main(connection, memory, capacity):
+    outputs = _output_rows(memory, capacity)
+    arrays = SoldierArrays({})
+    grid = None
+    while True:
+        message = connection.recv()
+        kind = message[0]
+        if kind == 'tick':
+            _, dt, now, player_x, player_y, hits, alive, offset = message
+            for i, damage, to_right in hits:
+                arrays.knock_back(i, damage, to_right)
+            if alive is not None:
+                arrays.compact(alive)
+            if arrays.columns and len(arrays):
+                fires = arrays.step(dt, grid, player_x, player_y, now)
+                rows = outputs[offset:offset + len(arrays)]
+                rows[:, _COLUMN['fires']] = fires
+                rows[:, _COLUMN['due']] = arrays.due
+                rows[arrays.due, _COLUMN['dt']] = arrays.due_dt
+                for name in _STATE:
+                    rows[:, _COLUMN[name]] = getattr(arrays, name)
+            connection.send(len(arrays) if arrays.columns else 0)
+        elif kind == 'load':
+            arrays = SoldierArrays(message[1])
+        elif kind == 'terrain':
+            grid = _TerrainGrid(message[1], message[2])
+        elif kind == 'state':
+            for i, damage, to_right in message[1]:
+                arrays.knock_back(i, damage, to_right)
+            connection.send({name: getattr(arrays, name) for name in arrays.columns})
+        elif kind == 'stop':
+            return
+
+
+# AssaultSoldierCrowd with the batched update split across worker processes. Each worker owns a contiguous slice of
+# the soldiers' arrays and writes positions, facing, fire decisions and which soldiers it stepped into a shared block,
+# which is read back in soldier order, so the result is the same as the single process crowd's whatever the worker
+# count.
+# The main process keeps only health and the soldier objects; knockback is queued to the workers for the next tick.
+class ParallelAssaultSoldierCrowd(AssaultSoldierCrowd):
+    def __init__(self, soldiers, workers=None):
+        self.worker_count = workers or os.cpu_count()
+        self._connections = []
+        self._processes = []
+        self._capacity = 0
+        super().__init__(soldiers)
+
+    def _start_workers(self, capacity):
+        self.close()
+        os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+        # Spawned rather than forked, the main process has loader and SDL threads running
+        context = multiprocessing.get_context('spawn')
+        self._capacity = capacity
+        self._memory = context.RawArray('d', capacity * len(_OUTPUTS))
+        self._outputs = _output_rows(self._memory, capacity)
+        for _ in range(self.worker_count):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=_worker_main,
+                                      args=(worker_connection, self._memory, capacity),
+                                      daemon=True)
+            process.start()
+            worker_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    def close(self):
+        for connection in self._connections:
+            connection.send(('stop',))
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def load(self, soldiers):
+        super().load(soldiers)
+        if len(self.soldiers) > self._capacity or not self._connections:
+            self._start_workers(max(2 * len(self.soldiers), 1024))
+        bounds = np.linspace(0, len(self.soldiers), self.worker_count + 1).astype(int)
+        for connection, start, stop in zip(self._connections, bounds[:-1], bounds[1:]):
+            connection.send(('load', {name: getattr(self, name)[start:stop] for name in self.columns}))
+        self._starts = bounds[:-1]
+        self._sizes = np.diff(bounds)
+        for name in _STATE:
+            self._outputs[:len(self.soldiers), _COLUMN[name]] = getattr(self, name)
+        self._hits = [[] for _ in self._connections]
+        self._terrain_source = None
+        # Everything else now lives in the workers
+        self.columns = ['health']
+
+    def knock_back(self, i, damage, to_right):
+        # Empty slices share their start with the next one, so the last slice starting at or before i holds it
+        worker = np.searchsorted(self._starts, i, 'right') - 1
+        self._hits[worker].append((i - self._starts[worker], damage, to_right))
+
+    def update(self, dt, terrain, player_pos, now):
+        alive_slices = [None] * self.worker_count
+        if self._has_dead:
+            alive = self._alive()
+            alive_slices = [alive[start:start + size] for start, size in zip(self._starts, self._sizes)]
+            self._sizes = np.array([np.count_nonzero(s) for s in alive_slices])
+            self._remove_dead(alive)
+        self._starts = np.concatenate(([0], np.cumsum(self._sizes)[:-1])).astype(int)
+
+        if terrain is not self._terrain_source:
+            self._terrain_source = terrain
+            rects, platform = _TerrainGrid.terrain_arrays(terrain)
+            for connection in self._connections:
+                connection.send(('terrain', rects, platform))
+        for connection, hits, alive, offset in zip(self._connections, self._hits, alive_slices, self._starts):
+            connection.send(('tick', dt, now, player_pos.x, player_pos.y, hits, alive, offset))
+        self._hits = [[] for _ in self._connections]
+        for connection in self._connections:
+            connection.recv()
+
+        if not self.soldiers:
+            return []
+        outputs = self._outputs[:len(self.soldiers)]
+        self.x, self.y = outputs[:, _COLUMN['x']], outputs[:, _COLUMN['y']]
+        self.moving_right = outputs[:, _COLUMN['moving_right']].astype(bool)
+        self.target_x, self.target_y = outputs[:, _COLUMN['target_x']], outputs[:, _COLUMN['target_y']]
+        due = outputs[:, _COLUMN['due']].astype(bool)
+        self._push_positions(due, outputs[due, _COLUMN['dt']])
+        return self._fire(outputs[:, _COLUMN['fires']].astype(bool))
+
+    def state_columns(self, names):
+        outputs = self._outputs[:len(self.soldiers)]
+        columns = {name: outputs[:, _COLUMN[name]] for name in _STATE}
+        columns['health'] = self.health
+        # Knockback still queued for the workers is applied to copies of the velocities
+        velocities = SoldierArrays({'x_vel': columns['x_vel'].copy(), 'y_vel': columns['y_vel'].copy()})
+        for start, hits in zip(self._starts, self._hits):
+            for i, damage, to_right in hits:
+                velocities.knock_back(start + i, damage, to_right)
+        columns['x_vel'], columns['y_vel'] = velocities.x_vel, velocities.y_vel
+        return [columns[name] for name in names]
+
+    def write_back(self):
+        for connection, hits in zip(self._connections, self._hits):
+            connection.send(('state', hits))
+        self._hits = [[] for _ in self._connections]
+        states = [connection.recv() for connection in self._connections]
+        for name in states[0]:
+            if name != 'health':
+                setattr(self, name, np.concatenate([state[name] for state in states]))
+        super().write_back()
@@ -0,0 +1,73 @@
+import threading
+
+import pygame
+
+import valkyrie
+from drawing import capture, present
+
+
+# Hands the newest RenderFrame from the simulation thread to the render thread. Frames are immutable, so publishing
+# is a reference swap: the simulation builds the next frame while the last published one waits and an older one is
+# drawn, as with a triple buffer, and neither side ever waits for the other to finish with a frame.
+class FrameBuffer:
+    def __init__(self, frame=None):
+        self._frame = frame
+        self._condition = threading.Condition()
+
+    def publish(self, frame):
+        with self._condition:
+            self._frame = frame
+            self._condition.notify_all()
+
+    def wait_newer(self, frame, timeout=None):
+        with self._condition:
+            self._condition.wait_for(lambda: self._frame is not frame, timeout)
+            return self._frame
+
+
+class SimulationThread(threading.Thread):
+    def __init__(self, game_state, level_update, inputs, recorder=None):
+        super().__init__(name="simulation", daemon=True)
+        self.game_state = game_state
+        self.level_update = level_update
+        # Replaced by the main thread whenever it polls, which is the only thread allowed to talk to SDL's input
+        self.inputs = inputs
+        self.recorder = recorder
+        self.frames = FrameBuffer(capture(game_state))
+        self.error = None
+        self._running = True
+
+    def run(self):
+        state = self.game_state
+        try:
+            while self._running:
+                dt = state.clock.tick(valkyrie.MAX_FPS) / 30
+                inputs = self.inputs
+                valkyrie.update(state, self.level_update, inputs, dt)
+                if self.recorder:
+                    self.recorder.record(dt, inputs, state)
+                self.frames.publish(capture(state))
+        except Exception as e:
+            self.error = e
+
+    def stop(self):
+        self._running = False
+        self.join()
+
+
+def run(window, game_state, level_update, recorder=None):
+    simulation = SimulationThread(game_state, level_update, valkyrie.read_inputs(), recorder)
+    simulation.start()
+    render_clock = pygame.time.Clock()
+    timer = game_state.phase_timer
+    frame = None
+    while valkyrie.handle_events(game_state):
+        simulation.inputs = valkyrie.read_inputs()
+        frame = simulation.frames.wait_newer(frame, timeout=0.1)
+        if simulation.error is not None:
+            raise simulation.error
+        timer.begin_frame()
+        present(window, frame, game_state, render_clock.get_fps())
+        timer.end_frame()
+        render_clock.tick(valkyrie.MAX_FPS)
+    simulation.stop()
@@ -0,0 +1,119 @@
+import json
+import sys
+import threading
+from collections import deque
+from time import perf_counter
+from typing import Dict
+
+
+class _Phase:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timer.add(self.name, perf_counter() - self.start, self.start)
+
+
+class PhaseTimer:
+    # Frames kept for the rolling frame time percentiles
+    window = 300
+
+    def __init__(self):
+        self.totals: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self._phases: Dict[str, _Phase] = {}
+        self.frame_times = deque(maxlen=self.window)
+        # The counters of the last finished frame, and of the one in progress
+        self.counters: Dict[str, int] = {}
+        self._frame_counters: Dict[str, int] = {}
+        self._frame_start = None
+        self._frame_blocks = 0
+        self.trace = None
+        # In pipelined mode the simulation thread adds phases while the render thread reads, resets and ends frames
+        self._lock = threading.Lock()
+
+    def phase(self, name):
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = _Phase(self, name)
+        return phase
+
+    def add(self, name, seconds, start=None):
+        with self._lock:
+            self.totals[name] = self.totals.get(name, 0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if self.trace is not None and start is not None:
+                self.trace.append((name, start, seconds, threading.current_thread().name))
+
+    def set_counter(self, name, value):
+        with self._lock:
+            self._frame_counters[name] = value
+
+    def begin_frame(self):
+        self._frame_start = perf_counter()
+        self._frame_blocks = sys.getallocatedblocks()
+
+    def end_frame(self):
+        if self._frame_start is None:
+            return
+        seconds = perf_counter() - self._frame_start
+        blocks = sys.getallocatedblocks() - self._frame_blocks
+        with self._lock:
+            self._frame_counters['allocated blocks'] = blocks
+            self.frame_times.append(seconds)
+            self.counters, self._frame_counters = self._frame_counters, {}
+            if self.trace is not None:
+                thread = threading.current_thread().name
+                self.trace.append(('frame', self._frame_start, seconds, thread))
+                self.trace.append(('counters', self._frame_start, self.counters, thread))
+        self._frame_start = None
+
+    def mean_ms(self, name):
+        with self._lock:
+            return self.totals[name] / self.counts[name] * 1000 if self.counts.get(name) else 0
+
+    def means_ms(self):
+        # A copy of every phase's mean, safe to iterate while another thread keeps adding phases
+        with self._lock:
+            return {name: total / self.counts[name] * 1000 for name, total in self.totals.items()}
+
+    def frame_percentile_ms(self, fraction):
+        with self._lock:
+            times = sorted(self.frame_times)
+        if not times:
+            return 0
+        return times[min(int(len(times) * fraction), len(times) - 1)] * 1000
+
+    def reset(self):
+        with self._lock:
+            self.totals.clear()
+            self.counts.clear()
+            self.frame_times.clear()
+
+    def start_tracing(self):
+        self.trace = []
+
+    def export_chrome_trace(self, path):
+        # Loads in chrome://tracing or Perfetto. Phases are complete ('X') events, counters are 'C' events, and each
+        # thread that recorded anything gets its own track
+        trace = self.trace or []
+        origin = min((start for _, start, _, _ in trace), default=0)
+        threads = {}
+        events = []
+        for name, start, value, thread in trace:
+            tid = threads.setdefault(thread, len(threads))
+            timestamp = (start - origin) * 1e6
+            if name == 'counters':
+                events.extend({'name': counter, 'ph': 'C', 'ts': timestamp, 'pid': 0, 'tid': tid,
+                               'args': {counter: count}} for counter, count in value.items())
+            else:
+                events.append({'name': name, 'ph': 'X', 'ts': timestamp, 'dur': value * 1e6, 'pid': 0, 'tid': tid})
+        events.extend({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': thread}}
+                      for thread, tid in threads.items())
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,207 @@
+import argparse
+import json
+import random
+import struct
+import sys
+import zlib
+from bisect import bisect_left
+from time import perf_counter
+
+import valkyrie
+from game_objects import Controls
+from snapshots import Snapshot
+
+RECORDED_KEYS = [Controls.up, Controls.left, Controls.right, Controls.down]
+HISTOGRAM_EDGES_MS = [0.25, 0.5, 1, 2, 4, 8, 16, 33, 66]
+
+
+def state_checksum(game_state):
+    player = game_state.player
+    values = [player.x, player.y, player.health, len(game_state.enemies)]
+    for enemy in game_state.enemies:
+        values += [enemy.x, enemy.y, enemy.crowd.health_of(enemy) if enemy.crowd is not None else enemy.health]
+    for projectiles in (game_state.player_projectiles, game_state.enemy_projectiles):
+        values.append(len(projectiles))
+        for proj in projectiles:
+            values += [proj.x, proj.y]
+    return zlib.crc32(struct.pack(f'<{len(values)}d', *values))
+
+
+class Recorder:
+    checksum_interval = 60
+
+    def __init__(self, seed, fixed_timestep, level='ONE'):
+        self.seed = seed
+        self.fixed_timestep = fixed_timestep
+        self.level = level
+        self.frames = []
+        self.checksums = []
+
+    def record(self, dt, inputs, game_state):
+        self.frames.append([dt,
+                            [key for key in RECORDED_KEYS if inputs.pressed[key]],
+                            bool(inputs.mouse_pressed),
+                            list(inputs.mouse_pos)])
+        if len(self.frames) % self.checksum_interval == 0:
+            self.checksums.append([len(self.frames) - 1, state_checksum(game_state)])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'seed': self.seed,
+                       'level': self.level,
+                       'fixed_timestep': self.fixed_timestep,
+                       'checksums': self.checksums,
+                       'frames': self.frames}, f)
+
+
+def replay(path, draw=False, vectorized=False, workers=0, trace_path=None, rollback=0):
+    import headless
+    import pygame
+    from asset_factory import AssetFactory
+    from levels import Level
+
+    with open(path) as f:
+        recording = json.load(f)
+    pygame.init()
+    window = pygame.display.set_mode((valkyrie.SCREEN_WIDTH, valkyrie.SCREEN_HEIGHT))
+    valkyrie.FIXED_TIMESTEP = recording['fixed_timestep']
+    random.seed(recording['seed'])
+    level = Level.load(Level[recording['level']], AssetFactory(raw_cache=valkyrie.RAW_ASSET_CACHE))
+    state = level.initial_game_state
+    headless.attach_crowd(state, vectorized, workers)
+    if draw:
+        from drawing import draw as draw_frame
+    timer = state.phase_timer
+    if trace_path:
+        timer.start_tracing()
+
+    def play(frame, draw):
+        dt, keys, mouse_pressed, mouse_pos = recording['frames'][frame]
+        inputs = valkyrie.Inputs(headless.PressedKeys(keys), mouse_pressed, tuple(mouse_pos))
+        valkyrie.update(state, level.update, inputs, dt)
+        if draw:
+            draw_frame(window, state)
+        else:
+            # Where draw would have left the camera, which the next frame aims the mouse from
+            state.last_camera_center = pygame.Vector2(state.player.sprite.interpolated_pos(state.interpolation_alpha))
+
+    expected = dict(recording['checksums'])
+    frame_ms = []
+    mismatches = []
+    rollback_mismatches = []
+    snapshot_us = []
+    for frame in range(len(recording['frames'])):
+        if rollback and frame % rollback == 0:
+            start = perf_counter()
+            snapshot = Snapshot.take(state, level)
+            snapshot_us.append((perf_counter() - start) * 1e6)
+            first_pass = []
+        start = perf_counter()
+        timer.begin_frame()
+        play(frame, draw)
+        timer.end_frame()
+        frame_ms.append((perf_counter() - start) * 1000)
+        if frame in expected and state_checksum(state) != expected[frame]:
+            mismatches.append(frame)
+
+        if rollback:
+            first_pass.append(state_checksum(state))
+            if len(first_pass) == rollback or frame == len(recording['frames']) - 1:
+                # Go back to the snapshot and play the same frames again, which must retrace every state exactly
+                snapshot.restore(state, level)
+                for i, checksum in enumerate(first_pass):
+                    play(frame - len(first_pass) + 1 + i, False)
+                    if state_checksum(state) != checksum:
+                        rollback_mismatches.append(frame - len(first_pass) + 1 + i)
+
+    if workers:
+        state.enemy_crowd.close()
+    if trace_path:
+        timer.export_chrome_trace(trace_path)
+    pygame.quit()
+    return {
+        'frames': len(frame_ms),
+        'checksums': len(expected),
+        'mismatched_frames': mismatches,
+        'rollback_mismatched_frames': rollback_mismatches,
+        'snapshot_us': snapshot_us,
+        'snapshot_bytes': len(snapshot) if rollback else 0,
+        'frame_ms': frame_ms,
+    }
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def frame_time_histogram(frame_ms):
+    counts = [0] * (len(HISTOGRAM_EDGES_MS) + 1)
+    for ms in frame_ms:
+        counts[bisect_left(HISTOGRAM_EDGES_MS, ms)] += 1
+    return counts
+
+
+def summary(report):
+    frame_ms = sorted(report['frame_ms'])
+    return {
+        'frames': report['frames'],
+        'checksums': report['checksums'],
+        'mismatched_frames': report['mismatched_frames'],
+        'total_ms': sum(frame_ms),
+        'p50_ms': percentile(frame_ms, 0.5),
+        'p90_ms': percentile(frame_ms, 0.9),
+        'p99_ms': percentile(frame_ms, 0.99),
+        'max_ms': frame_ms[-1],
+        'histogram': frame_time_histogram(frame_ms),
+        'snapshots': len(report['snapshot_us']),
+        'rollback_mismatched_frames': report['rollback_mismatched_frames'],
+        'snapshot_mean_us': sum(report['snapshot_us']) / len(report['snapshot_us']) if report['snapshot_us'] else 0,
+        'snapshot_bytes': report['snapshot_bytes'],
+    }
+
+
+def print_summary(summary):
+    if summary['mismatched_frames']:
+        print(f"DIVERGED: {len(summary['mismatched_frames'])} of {summary['checksums']} checksums differ, "
+              f"first at frame {summary['mismatched_frames'][0]}")
+    else:
+        print(f"all {summary['checksums']} checksums match")
+    print(f"{summary['frames']} frames in {summary['total_ms']:.1f} ms: p50 {summary['p50_ms']:.3f} ms, "
+          f"p90 {summary['p90_ms']:.3f} ms, p99 {summary['p99_ms']:.3f} ms, max {summary['max_ms']:.3f} ms")
+    widest = max(summary['histogram']) or 1
+    labels = [f"< {edge} ms" for edge in HISTOGRAM_EDGES_MS] + [f">= {HISTOGRAM_EDGES_MS[-1]} ms"]
+    for label, count in zip(labels, summary['histogram']):
+        print(f"  {label:>10} {count:>7} {'#' * round(40 * count / widest)}")
+    if summary['snapshots']:
+        if summary['rollback_mismatched_frames']:
+            print(f"ROLLBACK DIVERGED: {len(summary['rollback_mismatched_frames'])} re-simulated frames differ, "
+                  f"first at frame {summary['rollback_mismatched_frames'][0]}")
+        else:
+            print(f"all frames re-simulated from {summary['snapshots']} snapshots match")
+        print(f"snapshots take {summary['snapshot_mean_us']:.1f} us, the last was {summary['snapshot_bytes']} bytes")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Replay a recorded session and check it still plays out the same")
+    parser.add_argument('recording', help="JSON file written by valkyrie.py with RECORDING_PATH set")
+    parser.add_argument('--draw', action='store_true', help="draw every frame and include it in the frame times")
+    parser.add_argument('--vectorized', action='store_true', help="simulate soldiers with AssaultSoldierCrowd")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="simulate soldiers with ParallelAssaultSoldierCrowd across this many processes")
+    parser.add_argument('--trace', metavar='PATH', help="write the update and draw phases as Chrome trace JSON")
+    parser.add_argument('--rollback', type=int, default=0, metavar='FRAMES',
+                        help="snapshot every FRAMES frames, then restore and re-simulate them to check they repeat")
+    parser.add_argument('--json', action='store_true', help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    result = summary(replay(args.recording, draw=args.draw, vectorized=args.vectorized, workers=args.workers,
+                            trace_path=args.trace, rollback=args.rollback))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_summary(result)
+    return 1 if result['mismatched_frames'] or result['rollback_mismatched_frames'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,80 @@
+import heapq
+from itertools import count
+
+import pygame
+
+
+# Runs the AssaultSoldiers that are updated one at a time. A soldier far from the player with no burst under way goes
+# dormant and is only updated every dormant_interval of game time, catching up on the time it missed, and shots are
+# events on a queue keyed on game time, so a tick only touches the soldiers that are active or due. Soldiers run and
+# fire in the order they were loaded in, as they do in crowds.AssaultSoldierCrowd.
+class EnemyScheduler:
+    dormant_distance = 1200
+    # In game time, where 1 is 30ms
+    dormant_interval = 10
+
+    def __init__(self, soldiers=()):
+        self.load(soldiers)
+
+    def load(self, soldiers):
+        self.soldiers = list(soldiers)
+        self._order = {soldier: i for i, soldier in enumerate(self.soldiers)}
+        self._active = []
+        self._wakeups = []
+        self._shots = []
+        self._sequence = count()
+        for soldier in self.soldiers:
+            if soldier.dormant:
+                self._push(self._wakeups, soldier.updated_at + self.dormant_interval, soldier)
+            else:
+                self._active.append(soldier)
+            if soldier.shooting_at is not None:
+                self._push(self._shots, soldier.next_shot_at, soldier)
+
+    def _push(self, queue, time, soldier):
+        heapq.heappush(queue, (time, next(self._sequence), soldier))
+
+    def _pop_due(self, queue, now):
+        due = []
+        while queue and queue[0][0] <= now:
+            due.append(heapq.heappop(queue))
+        return due
+
+    @property
+    def active_count(self):
+        return len(self._active)
+
+    def is_dormant(self, soldier, player_pos):
+        dx, dy = soldier.hitbox.centerx - player_pos.x, soldier.hitbox.centery - player_pos.y
+        return (soldier.shooting_at is None and not soldier.in_air
+                and dx * dx + dy * dy > self.dormant_distance * self.dormant_distance)
+
+    def update(self, dt, now, terrain, player_pos, sight_queries):
+        soldiers = [s for s in self._active if not s.to_remove]
+        woken = [s for _, _, s in self._pop_due(self._wakeups, now) if not s.to_remove]
+        if woken:
+            soldiers = sorted(soldiers + woken, key=self._order.__getitem__)
+
+        in_sight = sight_queries.enemies_in_sight(soldiers, terrain, player_pos)
+        self._active = []
+        for soldier, sees_player in zip(soldiers, in_sight.tolist()):
+            idle = soldier.shooting_at is None
+            soldier_dt = dt if soldier.updated_at is None else now - soldier.updated_at
+            soldier.update(soldier_dt, terrain, pygame.Vector2(player_pos), sees_player, now)
+            if idle and soldier.shooting_at is not None:
+                self._push(self._shots, soldier.next_shot_at, soldier)
+            soldier.dormant = self.is_dormant(soldier, player_pos)
+            if soldier.dormant:
+                self._push(self._wakeups, now + self.dormant_interval, soldier)
+            else:
+                self._active.append(soldier)
+
+        # Entries left behind by a burst that ended or a soldier that died are skipped, and a shot that is due fires
+        # once this tick however far behind it is
+        firing = [s for time, _, s in self._pop_due(self._shots, now) if time == s.next_shot_at and not s.to_remove]
+        projectiles = []
+        for soldier in sorted(firing, key=self._order.__getitem__):
+            projectiles.append(soldier.fire_scheduled())
+            if soldier.shooting_at is not None:
+                self._push(self._shots, soldier.next_shot_at, soldier)
+        return projectiles
@@ -0,0 +1,200 @@
+import math
+import random
+import struct
+from itertools import starmap
+from operator import attrgetter
+
+import numpy as np
+import pygame
+
+from game_objects import projectile_pool
+
+# Everything that changes while the game runs, packed into one bytes object. Static data (terrain, animations and
+# their surfaces, soldier configuration) is never copied: the snapshot keeps references to what was live when it was
+# taken and points the restored objects back at them.
+_HEADER = struct.Struct('<4d??2d5I?')
+_SPRITE_FIELDS = ('_x', '_y', '_previous_x', '_previous_y', 'animation_time', 'sprite_num',
+                  'hitbox.x', 'hitbox.y', 'hitbox.w', 'hitbox.h')
+_SPRITE = '5dq4i'
+_BODY_FIELDS = ('x_vel', 'y_vel', 'force_dropping', 'in_air')
+_BODY = '2d??'
+_PLAYER = struct.Struct('<' + _SPRITE + _BODY + 'qd')
+_player_values = attrgetter(*('sprite.' + name for name in _SPRITE_FIELDS), *_BODY_FIELDS, 'health', 'till_next_shot')
+# A soldier is one row of doubles, so a crowd's arrays can be stacked into the same rows the objects are packed into.
+# Each field is named with the crowd column it comes from, None for the ones only the soldier objects hold, and the
+# type it is restored as
+_SOLDIER_FIELDS = [
+    ('sprite._x', 'x', float),
+    ('sprite._y', 'y', float),
+    ('sprite._previous_x', None, float),
+    ('sprite._previous_y', None, float),
+    ('sprite.animation_time', None, float),
+    ('sprite.sprite_num', None, int),
+    ('sprite.hitbox.x', 'hb_left', int),
+    ('sprite.hitbox.y', 'hb_top', int),
+    ('sprite.hitbox.w', 'hb_width', int),
+    ('sprite.hitbox.h', 'hb_height', int),
+    ('x_vel', 'x_vel', float),
+    ('y_vel', 'y_vel', float),
+    ('force_dropping', 'force_dropping', bool),
+    ('in_air', 'in_air', bool),
+    ('health', 'health', float),
+    ('moving_right', 'moving_right', bool),
+    ('shots_fired', 'shots_fired', int),
+    ('next_shot_at', 'next_shot_at', float),
+    ('dormant', 'dormant', bool),
+]
+# Then updated_at (NaN for None), whether the soldier is shooting and its target
+_SOLDIER_EXTRAS = [('updated_at', float), ('shooting', bool), ('target_x', float), ('target_y', float)]
+_SOLDIER = struct.Struct(f'<{len(_SOLDIER_FIELDS) + len(_SOLDIER_EXTRAS)}d')
+_soldier_values = attrgetter(*(path for path, _, _ in _SOLDIER_FIELDS))
+_soldier_kinds = [kind for _, _, kind in _SOLDIER_FIELDS] + [kind for _, kind in _SOLDIER_EXTRAS]
+_crowd_fields = [i for i, (_, column, _) in enumerate(_SOLDIER_FIELDS) if column is not None]
+_crowd_fields += range(len(_SOLDIER_FIELDS), len(_soldier_kinds))
+_crowd_columns = [column for _, column, _ in _SOLDIER_FIELDS if column is not None] + [n for n, _ in _SOLDIER_EXTRAS]
+_object_only = [i for i, (_, column, _) in enumerate(_SOLDIER_FIELDS) if column is None]
+_object_only_values = attrgetter(*(_SOLDIER_FIELDS[i][0] for i in _object_only))
+_PROJECTILE = struct.Struct('<' + _SPRITE + '2dq')
+_projectile_values = attrgetter(*_SPRITE_FIELDS, 'x_vel', 'y_vel', 'damage')
+
+
+def _soldier_row(soldier):
+    target = soldier.shooting_at
+    updated_at = math.nan if soldier.updated_at is None else soldier.updated_at
+    if target is None:
+        return _SOLDIER.pack(*_soldier_values(soldier), updated_at, False, 0, 0)
+    return _SOLDIER.pack(*_soldier_values(soldier), updated_at, True, *target)
+
+
+def _crowd_soldier_rows(crowd, soldiers):
+    # Straight from the crowd's arrays, which hold everything but the sprites' playheads and previous positions, so
+    # the crowd doesn't write back to the soldier objects (or make a round trip to its workers) on every take
+    crowd_rows = crowd.rows_of(soldiers)
+    held = crowd_rows >= 0
+    rows = np.empty((len(soldiers), len(_soldier_kinds)))
+    for i, values in zip(_crowd_fields, crowd.state_columns(_crowd_columns)):
+        rows[held, i] = values[crowd_rows[held]]
+    object_values = np.array(list(map(_object_only_values, soldiers)), dtype=float)
+    rows[:, _object_only] = object_values.reshape(len(soldiers), len(_object_only))
+    # The crowd keeps the last target after a burst, an idle soldier's is packed as 0, 0
+    shooting = len(_SOLDIER_FIELDS) + 1
+    rows[rows[:, shooting] == 0, shooting + 1:] = 0
+    # Soldiers that left the crowd (stashed ones, waiting to be removed) were written back when they left it
+    for i in np.flatnonzero(~held).tolist():
+        rows[i] = _SOLDIER.unpack(_soldier_row(soldiers[i]))
+    return rows.tobytes()
+
+
+def _restore_sprite(sprite, values, animation):
+    sprite._x, sprite._y, sprite._previous_x, sprite._previous_y, sprite.animation_time, sprite.sprite_num = values[:6]
+    sprite.hitbox.update(values[6:10])
+    sprite.animation = animation
+
+
+def _pack_slots(slots):
+    return struct.pack(f'<{len(slots)}I', *slots)
+
+
+class Snapshot:
+    __slots__ = ('data', 'terrain', 'random_state', 'enemies', 'animations', 'projectile_animations', 'level_state')
+
+    @classmethod
+    def take(cls, game_state, level=None):
+        crowd = game_state.enemy_crowd
+        snapshot = cls()
+        player = game_state.player
+        enemies = list(game_state.enemies)
+        projectiles = [*game_state.player_projectiles, *game_state.enemy_projectiles]
+        # Flagged entities are kept, along with the order they were flagged in and the order the crowd or scheduler
+        # runs the soldiers in, since both decide the order things are updated in once they are gone
+        flagged = [entities.flagged_slots()
+                   for entities in (game_state.enemies, game_state.player_projectiles, game_state.enemy_projectiles)]
+        runner = crowd if crowd is not None else game_state.enemy_scheduler
+        update_order = [s.container_slot for s in runner.soldiers if not s.to_remove]
+        camera = game_state.last_camera_center
+        parts = [_HEADER.pack(game_state.timer, game_state.cutscene_timer, game_state.accumulator,
+                              game_state.interpolation_alpha, game_state.in_cutscene,
+                              camera is not None, *(camera if camera is not None else (0, 0)),
+                              len(game_state.player_projectiles), *map(len, flagged), len(update_order),
+                              crowd is not None),
+                 *map(_pack_slots, flagged),
+                 _pack_slots(update_order),
+                 _PLAYER.pack(*_player_values(player)),
+                 _crowd_soldier_rows(crowd, enemies) if crowd is not None else b''.join(map(_soldier_row, enemies)),
+                 *starmap(_PROJECTILE.pack, map(_projectile_values, projectiles))]
+
+        snapshot.data = b''.join(parts)
+        snapshot.terrain = game_state.terrain
+        snapshot.random_state = random.getstate()
+        snapshot.enemies = enemies
+        snapshot.animations = [player.sprite.animation, *(e.sprite.animation for e in enemies),
+                               *(p.animation for p in projectiles)]
+        snapshot.projectile_animations = [p.animations for p in projectiles]
+        snapshot.level_state = level.streaming_state() if level is not None else None
+        return snapshot
+
+    def restore(self, game_state, level=None):
+        data = self.data
+        (game_state.timer, game_state.cutscene_timer, game_state.accumulator, game_state.interpolation_alpha,
+         game_state.in_cutscene, has_camera, camera_x, camera_y, player_projectile_count,
+         *slot_counts, has_crowd) = _HEADER.unpack_from(data)
+        game_state.last_camera_center = pygame.Vector2(camera_x, camera_y) if has_camera else None
+        offset = _HEADER.size
+        flagged = []
+        for count in slot_counts:
+            flagged.append(struct.unpack_from(f'<{count}I', data, offset))
+            offset += 4 * count
+        *flagged, update_order = flagged
+        random.setstate(self.random_state)
+        if level is not None and self.level_state is not None:
+            level.restore_streaming_state(self.level_state)
+        if game_state.terrain is not self.terrain:
+            game_state.set_terrain(self.terrain)
+        animations = iter(self.animations)
+
+        player = game_state.player
+        values = _PLAYER.unpack_from(data, offset)
+        offset += _PLAYER.size
+        _restore_sprite(player.sprite, values, next(animations))
+        player.x_vel, player.y_vel, player.force_dropping, player.in_air, player.health, player.till_next_shot = \
+            values[10:]
+
+        # Converted a column at a time, each to the type its field had
+        rows = np.frombuffer(data, dtype='<f8', count=len(self.enemies) * len(_soldier_kinds), offset=offset)
+        rows = rows.reshape(len(self.enemies), len(_soldier_kinds))
+        offset += rows.nbytes
+        columns = [rows[:, i].astype(kind).tolist() for i, kind in enumerate(_soldier_kinds)]
+        for enemy, values in zip(self.enemies, zip(*columns)):
+            _restore_sprite(enemy.sprite, values, next(animations))
+            (enemy.x_vel, enemy.y_vel, enemy.force_dropping, enemy.in_air, enemy.health, enemy.moving_right,
+             enemy.shots_fired, enemy.next_shot_at, enemy.dormant,
+             updated_at, shooting, target_x, target_y) = values[10:]
+            enemy.updated_at = None if math.isnan(updated_at) else updated_at
+            enemy.shooting_at = pygame.Vector2(target_x, target_y) if shooting else None
+            enemy.to_remove = False
+
+        projectile_pool.release(game_state.player_projectiles)
+        projectile_pool.release(game_state.enemy_projectiles)
+        projectiles = []
+        end = offset + len(self.projectile_animations) * _PROJECTILE.size
+        for proj_animations, values in zip(self.projectile_animations, _PROJECTILE.iter_unpack(data[offset:end])):
+            proj = projectile_pool.get(proj_animations, pygame.Vector2(values[:2]), pygame.Vector2(values[10:12]),
+                                       values[12])
+            _restore_sprite(proj, values, next(animations))
+            projectiles.append(proj)
+
+        game_state.enemies.replace(self.enemies)
+        game_state.player_projectiles.replace(projectiles[:player_projectile_count])
+        game_state.enemy_projectiles.replace(projectiles[player_projectile_count:])
+        for entities, slots in zip((game_state.enemies, game_state.player_projectiles, game_state.enemy_projectiles),
+                                   flagged):
+            for slot in slots:
+                entities[slot].to_remove = True
+        game_state.enemy_index = None
+        if game_state.enemy_crowd is not None and has_crowd:
+            game_state.enemy_crowd.load(self.enemies[slot] for slot in update_order)
+        elif game_state.enemy_crowd is None and not has_crowd:
+            game_state.enemy_scheduler.load(self.enemies[slot] for slot in update_order)
+
+    def __len__(self):
+        return len(self.data)
@@ -2,10 +2,13 @@ from game_objects import SingleSprite
 
 
 class Terrain(SingleSprite):
+    __slots__ = ('platform', 'block_object')
+
     def __init__(self, animations, initial_pos, initial_animation='neutral', platform=False):
         super().__init__(initial_pos=initial_pos,
                          animations=animations,
                          initial_animation=initial_animation)
+        self.platform = platform
         self.block_object = self.platform_block if platform else self.standard_block
 
     def take_damage(self, proj):
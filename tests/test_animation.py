@@ -0,0 +1,35 @@
+import pygame
+
+from animation import Animation
+
+
+def play(animation, steps, dt):
+    time, sprite_num = 0, 0
+    for _ in range(steps):
+        time, sprite_num = animation.advance(time, sprite_num, dt)
+        assert 0 <= time <= animation.total_duration
+        assert animation.frames[sprite_num] is not None
+    return time, sprite_num
+
+
+def test_rated_animation_wraps_without_leaving_the_frames():
+    animation = Animation('walk', ['a', 'b'], [5, 5], rate=0.5)
+    # Step 20 lands on time 10.5, which used to index past the last frame
+    assert play(animation, 21, 1) == (0.5, 0)
+
+
+def test_rated_animation_scales_with_dt():
+    animation = Animation('walk', ['a', 'b'], [5, 5], rate=0.5)
+    assert play(animation, 3, 4) == (6, 1)
+    assert play(animation, 7, 3) == (0.5, 0)
+
+
+def test_unrated_animation_steps_once_per_update():
+    animation = Animation('walk', ['a', 'b'], [5, 5])
+    assert play(animation, 5, 100) == (5, 0)
+    assert play(animation, 6, 100) == (6, 1)
+    assert play(animation, 11, 100) == (0, 0)
+
+
+def test_offsets_default_to_zero():
+    assert Animation('walk', ['a'], [1]).offsets == (pygame.Vector2(0, 0),)
@@ -1,5 +1,10 @@
+import random
+
 import pygame
+from typing import NamedTuple, Sequence, Tuple
+
 from asset_factory import AssetFactory
+from collision import SpatialHash
 from levels import Level
 
 SCREEN_WIDTH = 960
@@ -9,63 +14,170 @@ MAX_FPS = 500
 
 DEBUG = True
 
+DIRTY_RECTS = False
+
+VECTORIZED_ENEMIES = False
+# Split the vectorized enemy update across this many worker processes, 0 keeps it in this process
+ENEMY_WORKERS = 0
+
+# Keep decoded sprite pixels under bin/cache so later startups can map them instead of decoding PNGs
+RAW_ASSET_CACHE = False
+
+# Write the seed and every frame's inputs here on exit, for replay.py to play back
+RECORDING_PATH = None
+
+# Write every frame's update and draw phases and counters here on exit, as Chrome trace JSON
+TRACE_PATH = None
+
+# Run the simulation on its own thread, handing frames to this one to draw, so a slow update or draw doesn't hold up
+# the other
+PIPELINED = False
+
+FIXED_TIMESTEP = False
+SIMULATION_TICK_RATE = 60
+FIXED_DT = 1000 / SIMULATION_TICK_RATE / 30
+MAX_STEPS_PER_FRAME = 5
+
 
 def cutscene_update(game_state):
     if game_state.cutscene_timer > 50:
         game_state.in_cutscene = False
 
 
-def update(game_state, level_update):
-    dt = game_state.clock.tick(MAX_FPS) / 30
-    level_update(dt, game_state)
-    game_state.remove_to_remove_objects()
+class Inputs(NamedTuple):
+    pressed: Sequence[bool]
+    mouse_pressed: bool
+    mouse_pos: Tuple[int, int]
 
-    if game_state.in_cutscene:
-        cutscene_update(game_state)
-    else:
-        player = game_state.player
-        pressed = pygame.key.get_pressed()
-        player.update(pressed, dt, game_state.terrain)
 
-        if pygame.mouse.get_pressed()[0]:
-            mx, my = pygame.mouse.get_pos()
-            offset = pygame.Vector2(mx - SCREEN_WIDTH // 2, my - SCREEN_HEIGHT // 2)
-            mouse_world_pos = game_state.last_camera_center + offset
-            new_proj = player.shoot_at(mouse_world_pos)
-            if new_proj:
-                game_state.player_projectiles.append(new_proj)
+def read_inputs():
+    return Inputs(pygame.key.get_pressed(), pygame.mouse.get_pressed()[0], pygame.mouse.get_pos())
 
-        for enemy in game_state.enemies:
-            new_proj = enemy.update(dt, game_state.terrain, pygame.Vector2(player.hitbox.center))
-            if new_proj:
-                game_state.enemy_projectiles.append(new_proj)
 
-        for proj in game_state.player_projectiles:
-            proj.update(dt, *game_state.terrain, *game_state.enemies)
+def handle_events(game_state):
+    running = True
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            running = False
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_q:
+            running = False
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+            game_state.show_profiler = not game_state.show_profiler
+            game_state.phase_timer.reset()
+    return running
+
+
+def update(game_state, level_update, inputs=None, dt=None):
+    if inputs is None:
+        inputs = read_inputs()
+    if dt is None:
+        dt = game_state.clock.tick(MAX_FPS) / 30
+    if not FIXED_TIMESTEP:
+        simulate(game_state, level_update, dt, inputs)
+        return
+
+    game_state.accumulator += dt
+    steps = 0
+    while game_state.accumulator >= FIXED_DT and steps < MAX_STEPS_PER_FRAME:
+        game_state.store_previous_positions()
+        simulate(game_state, level_update, FIXED_DT, inputs)
+        game_state.accumulator -= FIXED_DT
+        steps += 1
+    # Drop the backlog rather than trying to catch up forever after a long stall
+    game_state.accumulator = min(game_state.accumulator, FIXED_DT)
+    game_state.interpolation_alpha = game_state.accumulator / FIXED_DT
+
+
+def simulate(game_state, level_update, dt, inputs):
+    timer = game_state.phase_timer
+    with timer.phase('level'):
+        level_update(dt, game_state)
+    with timer.phase('removal'):
+        game_state.remove_to_remove_objects()
 
-        for enemy_proj in game_state.enemy_projectiles:
-            enemy_proj.update(dt, *game_state.terrain, *[game_state.player])
+    if game_state.in_cutscene:
+        cutscene_update(game_state)
+    else:
+        player = game_state.player
+        with timer.phase('player'):
+            player.update(inputs.pressed, dt, game_state.terrain_index)
+
+            if inputs.mouse_pressed:
+                mx, my = inputs.mouse_pos
+                offset = pygame.Vector2(mx - SCREEN_WIDTH // 2, my - SCREEN_HEIGHT // 2)
+                mouse_world_pos = game_state.last_camera_center + offset
+                new_proj = player.shoot_at(mouse_world_pos)
+                if new_proj:
+                    game_state.player_projectiles.append(new_proj)
+
+        with timer.phase('enemies'):
+            player_pos = pygame.Vector2(player.hitbox.center)
+            if game_state.enemy_crowd is not None:
+                new_projs = game_state.enemy_crowd.update(dt, game_state.terrain_index, player_pos, game_state.timer)
+            else:
+                new_projs = game_state.enemy_scheduler.update(dt, game_state.timer, game_state.terrain_index,
+                                                              player_pos, game_state.sight_queries)
+            game_state.enemy_projectiles.extend(new_projs)
+
+        with timer.phase('projectiles'):
+            game_state.enemy_index = SpatialHash(game_state.enemies)
+            for proj in game_state.player_projectiles:
+                proj.update(dt, game_state.terrain_index, game_state.enemy_index)
+
+            player_index = SpatialHash([player])
+            for enemy_proj in game_state.enemy_projectiles:
+                enemy_proj.update(dt, game_state.terrain_index, player_index)
 
 
 def main():
     from drawing import draw
     pygame.init()
 
+    seed = random.randrange(2 ** 32)
+    random.seed(seed)
+    # Loading the level starts decoding its sprites on the loader threads, which only need pygame initialised, so it
+    # overlaps opening the window. Converting them needs the window, and the first cutscene frame draws them
+    level = Level.load(Level.ONE, AssetFactory(raw_cache=RAW_ASSET_CACHE))
     window = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     pygame.display.set_caption("Valkyrie")
-    level = Level.load(Level.ONE, AssetFactory())
+    recorder = None
+    if RECORDING_PATH:
+        from replay import Recorder
+        recorder = Recorder(seed, FIXED_TIMESTEP)
     state = level.initial_game_state
-
-    running = True
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            if event.type == pygame.KEYDOWN and event.key == pygame.K_q:
-                running = False
-        update(state, level.update)
-        draw(window, state)
-    pygame.quit()
+    if VECTORIZED_ENEMIES and ENEMY_WORKERS:
+        from parallel_crowds import ParallelAssaultSoldierCrowd
+        state.enemy_crowd = ParallelAssaultSoldierCrowd(state.enemies, workers=ENEMY_WORKERS)
+    elif VECTORIZED_ENEMIES:
+        from crowds import AssaultSoldierCrowd
+        state.enemy_crowd = AssaultSoldierCrowd(state.enemies)
+    timer = state.phase_timer
+    if TRACE_PATH:
+        timer.start_tracing()
+
+    try:
+        if PIPELINED:
+            import pipeline
+            pipeline.run(window, state, level.update, recorder)
+        else:
+            while handle_events(state):
+                inputs = read_inputs()
+                dt = state.clock.tick(MAX_FPS) / 30
+                timer.begin_frame()
+                update(state, level.update, inputs, dt)
+                if recorder:
+                    recorder.record(dt, inputs, state)
+                draw(window, state)
+                timer.end_frame()
+        if recorder:
+            recorder.save(RECORDING_PATH)
+        if TRACE_PATH:
+            timer.export_chrome_trace(TRACE_PATH)
+    finally:
+        if state.enemy_crowd is not None:
+            # Stops a ParallelAssaultSoldierCrowd's worker processes rather than leaving them to interpreter teardown
+            state.enemy_crowd.close()
+        pygame.quit()
 
 
 if __name__ == "__main__":